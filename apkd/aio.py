@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Optional
+
+from apkd.cache import MetadataCache
+from apkd.main import (
+    Utils,
+    add_details_rows,
+    add_developers_rows,
+    add_versions_rows,
+    create_progress_callbacks,
+)
+from apkd.store import ContentStore
+from apkd.utils import (
+    App,
+    AppDetails,
+    AppNotFoundError,
+    AppVersion,
+    BaseSource,
+    DeveloperNotFoundError,
+    get_logger,
+)
+
+if TYPE_CHECKING:
+    from prettytable import PrettyTable
+
+
+class AsyncApkd:
+    __sources: dict[str, BaseSource]
+    __semaphore: asyncio.Semaphore
+    source_timeout: float | None
+    cache: MetadataCache | None
+    store: ContentStore | None
+
+    def __init__(
+        self,
+        auto_load_sources: bool = True,
+        concurrency: int = 100,
+        source_timeout: float | None = 60,
+        cache: MetadataCache | None = None,
+        store: ContentStore | None = None,
+    ):
+        self.__sources = {}
+        self.cache = cache
+        self.store = store
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.source_timeout = source_timeout
+        if auto_load_sources:
+            self.__sources = Utils.import_sources()
+
+    def add_source(self, source_name: str, source: BaseSource):
+        self.__sources[source_name] = source
+
+    def remove_source(self, source_name: str):
+        if source_name in self.__sources:
+            del self.__sources[source_name]
+
+    def clear_sources(self):
+        self.__sources.clear()
+
+    def get_sources(self):
+        return self.__sources.copy()
+
+    async def __call_source(self, func: Callable, *args):
+        async with self.__semaphore:
+            try:
+                return await asyncio.wait_for(func(*args), timeout=self.source_timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("timed out")
+
+    async def get_app_info(
+        self, package_name: str, versions_limit: int = -1
+    ) -> list[App]:
+        return await self.__get_app_info(package_name, versions_limit, self.cache)
+
+    async def __get_app_info(
+        self, package_name: str, versions_limit: int, cache: MetadataCache | None
+    ) -> list[App]:
+        async def get_source_app_info(source: BaseSource) -> App:
+            if cache is not None:
+                app = cache.load(source, package_name, versions_limit)
+                if app is not None:
+                    return app
+                if cache.offline:
+                    raise AppNotFoundError()
+            try:
+                app = await self.__call_source(
+                    source.get_app_info_async, package_name, versions_limit
+                )
+            except AppNotFoundError:
+                if cache is not None:
+                    cache.store(source, package_name, versions_limit, None)
+                raise
+            if cache is not None:
+                cache.store(source, package_name, versions_limit, app)
+            return app
+
+        sources = list(self.__sources.values())
+        results = await asyncio.gather(
+            *(get_source_app_info(source) for source in sources),
+            return_exceptions=True,
+        )
+
+        apps: list[App] = list()
+        for source, result in zip(sources, results):
+            if isinstance(result, AppNotFoundError):
+                continue
+            elif isinstance(result, Exception):
+                get_logger().error(f"Error at {source.name}: {result}")
+                continue
+            apps.append(result)
+
+        if len(apps) == 0:
+            raise AppNotFoundError(f"{package_name} not found")
+
+        return apps
+
+    async def resolve_version(
+        self, package_name: str, version_code: int = -1
+    ) -> AppVersion:
+        if version_code == -1:
+            apps = await self.__get_app_info(package_name, 1, None)
+            last_version = Utils.find_last_version(apps)
+            if last_version is None:
+                raise AppNotFoundError(f"{package_name} not found")
+            return last_version
+
+        async def lookup(source: BaseSource) -> AppVersion | None:
+            try:
+                app = await self.__call_source(source.get_app_info_async, package_name)
+            except AppNotFoundError:
+                return None
+            except Exception as e:
+                get_logger().error(f"Error at {source.name}: {e}")
+                return None
+            return next((v for v in app.get_versions() if v.code == version_code), None)
+
+        tasks = [asyncio.create_task(lookup(s)) for s in self.__sources.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                version = await next_done
+                if version is not None:
+                    return version
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        raise AppNotFoundError(f"Version {version_code} not found")
+
+    async def download_app(
+        self,
+        package_name: str,
+        version_code: int = -1,
+        output_file: Optional[str] = None,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ) -> None:
+        version = await self.resolve_download(package_name, version_code, output_file)
+        if version is None:
+            return
+        await self.download_version(
+            package_name,
+            version,
+            output_file,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+
+    async def resolve_download(
+        self,
+        package_name: str,
+        version_code: int = -1,
+        output_file: Optional[str] = None,
+    ) -> AppVersion | None:
+        # None if the version is already in the store and has been linked
+        if (
+            self.store is not None
+            and version_code != -1
+            and await asyncio.to_thread(
+                self.store.link_existing, package_name, version_code, output_file
+            )
+        ):
+            return None
+
+        return await self.resolve_version(package_name, version_code)
+
+    async def download_version(
+        self,
+        package_name: str,
+        version: AppVersion,
+        output_file: Optional[str] = None,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ) -> None:
+        if self.store is not None:
+            await asyncio.to_thread(
+                self.store.download_app,
+                package_name,
+                version,
+                output_file,
+                on_download_start,
+                on_chunk_received,
+                on_download_end,
+            )
+            return
+
+        await version.source.download_app_async(
+            package_name,
+            version,
+            output_file,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+
+    async def get_developer_id(
+        self, package_name: str
+    ) -> set[tuple[BaseSource, str]]:
+        async def lookup(source: BaseSource) -> str | None:
+            try:
+                return await self.__call_source(
+                    source.get_developer_id_async, package_name
+                )
+            except AppNotFoundError:
+                return None
+
+        sources = list(self.__sources.values())
+        results = await asyncio.gather(*(lookup(source) for source in sources))
+        developers = {
+            (source, developer)
+            for source, developer in zip(sources, results)
+            if developer is not None
+        }
+
+        if len(developers) == 0:
+            raise AppNotFoundError(f"{package_name} not found")
+
+        return developers
+
+    async def get_app_details(
+        self, package_name: str, versions_limit: int = -1
+    ) -> list[AppDetails]:
+        cache = self.cache
+
+        async def lookup(source: BaseSource) -> AppDetails:
+            details = await self.__call_source(
+                source.get_app_details_async, package_name, versions_limit
+            )
+            if cache is not None:
+                cache.store(source, package_name, versions_limit, details.app)
+            return details
+
+        sources = list(self.__sources.values())
+        results = await asyncio.gather(
+            *(lookup(source) for source in sources), return_exceptions=True
+        )
+
+        apps_details: list[AppDetails] = list()
+        for source, result in zip(sources, results):
+            if isinstance(result, AppNotFoundError):
+                continue
+            elif isinstance(result, Exception):
+                get_logger().error(f"Error at {source.name}: {result}")
+                continue
+            apps_details.append(result)
+
+        if len(apps_details) == 0:
+            raise AppNotFoundError(f"{package_name} not found")
+
+        return apps_details
+
+    async def get_packages_from_developer(self, developer_id: str) -> set[str]:
+        async def lookup(source: BaseSource) -> set[str]:
+            try:
+                return await self.__call_source(
+                    source.find_packages_from_developer_async, developer_id
+                )
+            except DeveloperNotFoundError:
+                return set()
+
+        packages = set()
+        for result in await asyncio.gather(
+            *(lookup(source) for source in self.__sources.values())
+        ):
+            packages.update(result)
+
+        return packages
+
+
+async def run_async(
+    apkd: AsyncApkd,
+    packages: set[tuple[str, int]],
+    args: argparse.Namespace,
+    versions_table: "PrettyTable | None",
+    developers_table: "PrettyTable | None",
+    versions_limit: int = -1,
+):
+    # blocking sources are offloaded to the default executor, size it so
+    # that it does not become the bottleneck of the engine
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="apkd")
+    )
+    lock = Lock()
+    downloads = asyncio.Semaphore(args.download_jobs)
+
+    async def process(pkg: str, version_code: int):
+        if args.download:
+            # lookups run at full concurrency, only the transfers are limited
+            try:
+                version = await apkd.resolve_download(pkg, version_code, args.output)
+                if version is None:
+                    return
+                async with downloads:
+                    await apkd.download_version(
+                        pkg, version, args.output, *create_progress_callbacks(pkg)
+                    )
+            except AppNotFoundError:
+                pass
+            except Exception as e:
+                get_logger().error(f'Error at download_versions for "{pkg}": {e}')
+        elif args.list_versions and args.list_developers:
+            assert versions_table is not None and developers_table is not None
+            apps_details: list[AppDetails] | None = None
+            try:
+                apps_details = await apkd.get_app_details(pkg)
+            except Exception as e:
+                if not isinstance(e, AppNotFoundError):
+                    get_logger().error(f'Error at list_apps_details for "{pkg}": {e}')
+            add_details_rows(lock, versions_table, developers_table, pkg, apps_details)
+        elif args.list_versions:
+            assert versions_table is not None
+            apps: list[App] | None = None
+            try:
+                apps = await apkd.get_app_info(pkg, versions_limit)
+            except Exception as e:
+                if not isinstance(e, AppNotFoundError):
+                    get_logger().error(f'Error at list_apps_versions for "{pkg}": {e}')
+            add_versions_rows(lock, versions_table, pkg, apps)
+        elif args.list_developers:
+            assert developers_table is not None
+            developers: set[tuple[BaseSource, str]] | None = None
+            try:
+                developers = await apkd.get_developer_id(pkg)
+            except Exception:
+                pass
+            add_developers_rows(lock, developers_table, pkg, developers)
+
+    await asyncio.gather(
+        *(process(pkg, version_code) for pkg, version_code in packages)
+    )
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+from typing import Optional
+
+from apkd.utils import (
+    App,
+    AppNotFoundError,
+    AppVersion,
+    BaseSource,
+    get_cache_dir,
+    get_logger,
+)
+
+
+class MetadataCache:
+    path: str
+    refresh: bool
+    offline: bool
+    __connection: sqlite3.Connection
+    __lock: Lock
+
+    def __init__(
+        self, path: Optional[str] = None, refresh: bool = False, offline: bool = False
+    ):
+        self.path = path or os.path.join(get_cache_dir(), "metadata.sqlite")
+        self.refresh = refresh
+        self.offline = offline
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS apps ("
+                "source TEXT NOT NULL, "
+                "package TEXT NOT NULL, "
+                "versions_limit INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL, "
+                # NULL is a cached "not found"
+                "versions TEXT, "
+                "PRIMARY KEY (source, package, versions_limit))"
+            )
+
+    def get_app_info(
+        self, source: BaseSource, package: str, versions_limit: int = -1
+    ) -> App:
+        app = self.load(source, package, versions_limit)
+        if app is not None:
+            return app
+        if self.offline:
+            raise AppNotFoundError()
+
+        try:
+            app = source.get_app_info(package, versions_limit)
+        except AppNotFoundError:
+            self.store(source, package, versions_limit, None)
+            raise
+        self.store(source, package, versions_limit, app)
+
+        return app
+
+    def get_apps_info(
+        self, source: BaseSource, packages: list[str], versions_limit: int = -1
+    ) -> dict[str, App]:
+        apps: dict[str, App] = {}
+        missed: list[str] = []
+        for package in packages:
+            try:
+                app = self.load(source, package, versions_limit)
+            except AppNotFoundError:
+                continue
+            if app is None:
+                missed.append(package)
+            else:
+                apps[package] = app
+        if self.offline or len(missed) == 0:
+            return apps
+
+        # packages of a failed batch are not cached, they are retried next time
+        for batch in source.split_batches(missed):
+            try:
+                fetched = source.get_apps_info(batch, versions_limit)
+            except Exception as e:
+                get_logger().error(f"Error at {source.name}: {e}")
+                continue
+            for package in batch:
+                self.store(source, package, versions_limit, fetched.get(package))
+            apps.update(fetched)
+
+        return apps
+
+    def load(
+        self, source: BaseSource, package: str, versions_limit: int = -1
+    ) -> App | None:
+        if self.refresh:
+            return None
+
+        # a full versions list also answers any limited lookup
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT versions_limit, updated_at, versions FROM apps "
+                "WHERE source = ? AND package = ? AND versions_limit IN (?, -1)",
+                (source.name, package, versions_limit),
+            ).fetchall()
+        rows.sort(key=lambda row: row[0] != versions_limit)
+        for _, updated_at, versions in rows:
+            if not self.offline and time.time() - updated_at > source.cache_ttl:
+                continue
+            if versions is None:
+                raise AppNotFoundError()
+            app = App(package, source)
+            app.set_versions(
+                [self.__deserialize_version(source, v) for v in json.loads(versions)]
+            )
+            if versions_limit != -1:
+                app.set_versions(app.get_versions()[:versions_limit])
+            return app
+
+        return None
+
+    def store(
+        self,
+        source: BaseSource,
+        package: str,
+        versions_limit: int,
+        app: App | None,
+    ):
+        versions = None
+        if app is not None:
+            versions = json.dumps(
+                [self.__serialize_version(v) for v in app.get_versions()]
+            )
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO apps VALUES (?, ?, ?, ?, ?)",
+                (source.name, package, versions_limit, time.time(), versions),
+            )
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    @staticmethod
+    def __serialize_version(version: AppVersion) -> dict:
+        return {
+            "name": version.name,
+            "code": version.code,
+            "size": version.size,
+            "update_date": version.update_date,
+            "download_link": version.download_link,
+        }
+
+    @staticmethod
+    def __deserialize_version(source: BaseSource, data: dict) -> AppVersion:
+        return AppVersion(
+            data["name"],
+            data["code"],
+            data["size"],
+            source,
+            data["update_date"],
+            data["download_link"],
+        )
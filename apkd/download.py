@@ -0,0 +1,565 @@
+import hashlib
+import json
+import math
+import os
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING, Callable, Optional
+
+import requests
+import urllib3
+
+from apkd.net import Request, TokenBucket
+from apkd.utils import get_logger, save_json
+
+if TYPE_CHECKING:
+    from apkd.utils import BaseSource
+
+
+class PartFile:
+    # the file is downloaded into "<filename>.part", the sidecar
+    # "<filename>.part.json" describes what the part belongs to
+    filename: str
+    path: str
+    meta_path: str
+    meta: dict
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.path = f"{filename}.part"
+        self.meta_path = f"{filename}.part.json"
+        self.meta = {}
+        try:
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def matches(self, url: str, file_size: int) -> bool:
+        if not os.path.exists(self.path) or len(self.meta) == 0:
+            return False
+        if self.meta.get("url") == url:
+            return True
+        # signed links change between runs, the validators make sure that
+        # the server still has the same file
+        has_validator = bool(self.meta.get("etag") or self.meta.get("last_modified"))
+        return has_validator and file_size > 0 and self.meta.get("size") == file_size
+
+    def validator(self) -> Optional[str]:
+        return self.meta.get("etag") or self.meta.get("last_modified")
+
+    def save_meta(
+        self,
+        url: str,
+        size: int,
+        response: requests.Response,
+        pieces: Optional[list[list[int]]] = None,
+    ):
+        self.meta = {
+            "url": url,
+            "size": size,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if pieces is not None:
+            # segmented download: byte ranges and the starts of finished ones
+            self.meta["pieces"] = pieces
+            self.meta["pieces_done"] = []
+        self.__write_meta()
+
+    def mark_piece_done(self, start: int):
+        self.meta["pieces_done"].append(start)
+        self.__write_meta()
+
+    def __write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump(self.meta, f)
+
+    def discard(self):
+        for path in (self.path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.meta = {}
+
+    def commit(self):
+        os.replace(self.path, self.filename)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+
+class IncompleteDownloadError(requests.exceptions.ConnectionError):
+    pass
+
+
+class FileDownloader:
+    # segmented downloads split the file into pieces of at least this size
+    MIN_PIECE_SIZE = 4 * 1024 * 1024
+    # how often the number of connections is reconsidered, in seconds
+    SEGMENTS_ADJUST_INTERVAL = 1.0
+    # reads grow while they are fast and shrink on slow links, so progress
+    # (and throttling) stays smooth without a Python call per few KB
+    MIN_CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 4 * 1024 * 1024
+    CHUNK_READ_TIME = 0.1
+    # progress is reported at most this often and after this many bytes
+    PROGRESS_INTERVAL = 0.1
+    PROGRESS_BYTES = 256 * 1024
+    RETRY_EXCEPTIONS = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+
+    url: str
+    headers: dict
+    filename: str
+    file_size: int
+    retries: int
+    segments: int
+    digests: tuple[str, ...]
+    throttles: tuple[TokenBucket, ...]
+    source: Optional["BaseSource"]
+    checksums: dict[str, str]
+    on_download_start: Callable[[int], None] | None
+    on_chunk_received: Callable[[int], None] | None
+    on_download_end: Callable[[int], None] | None
+    __started: bool
+    __reported_size: int
+    __reported_at: float
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict,
+        filename: str,
+        file_size: int,
+        on_download_start: Callable[[int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+        retries: int = 3,
+        segments: int = 1,
+        digests: tuple[str, ...] = ("sha256",),
+        throttles: tuple[TokenBucket, ...] = (),
+        source: Optional["BaseSource"] = None,
+    ):
+        self.url = url
+        self.headers = headers
+        self.filename = filename
+        self.file_size = file_size
+        self.retries = retries
+        self.segments = segments
+        self.digests = digests
+        self.throttles = throttles
+        self.source = source
+        self.checksums = {}
+        self.on_download_start = on_download_start
+        self.on_chunk_received = on_chunk_received
+        self.on_download_end = on_download_end
+        self.__started = False
+        self.__reported_size = 0
+        self.__reported_at = 0
+
+    def download(self) -> dict[str, str]:
+        part = PartFile(self.filename)
+        if not part.matches(self.url, self.file_size):
+            part.discard()
+
+        attempt = 0
+        while True:
+            try:
+                if "pieces" in part.meta:
+                    downloaded = self.__transfer_segmented(part)
+                else:
+                    downloaded = self.__transfer(part)
+                break
+            except (*self.RETRY_EXCEPTIONS, requests.exceptions.HTTPError) as e:
+                attempt += 1
+                if attempt > self.retries or not self.__is_retryable(e):
+                    raise
+                delay = min(2**attempt, 30)
+                resume = "retrying"
+                if part.size() > 0:
+                    resume = f"resuming from {part.size()} bytes"
+                get_logger().warning(
+                    f"Download of {self.filename} interrupted ({e}), {resume}, "
+                    f"retry {attempt}/{self.retries} in {delay}s"
+                )
+                time.sleep(delay)
+
+        part.commit()
+        self.__report(downloaded, force=True)
+        if self.on_download_end is not None:
+            self.on_download_end(downloaded)
+
+        return self.checksums
+
+    def __transfer(self, part: PartFile) -> int:
+        offset = part.size()
+        headers = self.headers.copy()
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+            validator = part.validator()
+            if validator is not None:
+                headers["If-Range"] = validator
+
+        r = self.__get(headers)
+        with r:
+            if r.status_code == 416 and offset > 0:
+                if offset == part.meta.get("size"):
+                    # the previous run stopped right before the rename
+                    self.__start(offset)
+                    self.__set_checksums(self.__hash_file(part.path))
+                    return offset
+                part.discard()
+                raise IncompleteDownloadError("Range not satisfiable, restarting")
+
+            file_size = self.file_size
+            if r.status_code == 206:
+                content_range = r.headers.get("Content-Range", "")
+                total = content_range.rpartition("/")[2]
+                if total.isdigit():
+                    file_size = int(total)
+                mode = "ab"
+            else:
+                # the server ignored the range (or the validator changed)
+                if "Content-Length" in r.headers:
+                    file_size = int(r.headers["Content-Length"])
+                mode = "wb"
+
+            r.raise_for_status()
+            pieces = None
+            if mode == "wb":
+                pieces = self.__split(file_size, r)
+            if pieces is not None:
+                # ranges are supported, continue over parallel connections
+                part.save_meta(self.url, file_size, r, pieces)
+            else:
+                self.__start(file_size)
+                if mode == "wb" or len(part.meta) == 0:
+                    part.save_meta(self.url, file_size, r)
+                # digests are computed over the stream, only a resumed
+                # prefix has to be read back
+                hashes = self.__new_hashes()
+                downloaded = 0
+                if mode == "ab":
+                    hashes = self.__hash_file(part.path)
+                    downloaded = offset
+                with open(part.path, mode) as f:
+                    for chunk in self.__iter_chunks(r):
+                        f.write(chunk)
+                        for h in hashes:
+                            h.update(chunk)
+                        downloaded += len(chunk)
+                        self.__report(downloaded)
+                self.__set_checksums(hashes)
+
+        if pieces is not None:
+            return self.__transfer_segmented(part)
+
+        if "Content-Length" in r.headers or r.status_code == 206:
+            if file_size > 0 and downloaded < file_size:
+                raise IncompleteDownloadError(
+                    f"Received {downloaded} of {file_size} bytes"
+                )
+
+        return downloaded
+
+    def __split(
+        self, file_size: int, response: requests.Response
+    ) -> Optional[list[list[int]]]:
+        if self.segments < 2 or response.headers.get("Accept-Ranges") != "bytes":
+            return None
+        if "Content-Length" not in response.headers:
+            return None
+        if file_size < self.MIN_PIECE_SIZE * 2:
+            return None
+        # a few pieces per connection, so fast connections take over the
+        # work of slow ones
+        piece_size = max(
+            self.MIN_PIECE_SIZE, math.ceil(file_size / (self.segments * 4))
+        )
+        return [
+            [start, min(start + piece_size, file_size) - 1]
+            for start in range(0, file_size, piece_size)
+        ]
+
+    def __transfer_segmented(self, part: PartFile) -> int:
+        file_size: int = part.meta["size"]
+        done = set(part.meta["pieces_done"])
+        pending = deque(
+            (start, end) for start, end in part.meta["pieces"] if start not in done
+        )
+        downloaded = file_size - sum(end - start + 1 for start, end in pending)
+        lock = Lock()
+        errors: list[Exception] = []
+
+        # preallocate, every connection writes its pieces at their offsets
+        with open(part.path, "ab") as f:
+            f.truncate(file_size)
+        self.__start(file_size)
+
+        def fetch_piece(f, start: int, end: int):
+            nonlocal downloaded
+            headers = self.headers | {"Range": f"bytes={start}-{end}"}
+            validator = part.validator()
+            if validator is not None:
+                headers["If-Range"] = validator
+            with self.__get(headers) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IncompleteDownloadError("File changed on the server")
+                f.seek(start)
+                received = 0
+                for chunk in self.__iter_chunks(r):
+                    f.write(chunk)
+                    received += len(chunk)
+                    with lock:
+                        downloaded += len(chunk)
+                        self.__report(downloaded)
+            if received != end - start + 1:
+                with lock:
+                    downloaded -= received
+                raise IncompleteDownloadError(
+                    f"Received {received} of {end - start + 1} bytes"
+                )
+
+        # set by every finished worker, wakes the monitor loop below
+        worker_exited = Event()
+        exited = 0
+
+        def worker():
+            nonlocal exited
+            try:
+                with open(part.path, "r+b") as f:
+                    while len(errors) == 0:
+                        with lock:
+                            if len(pending) == 0:
+                                return
+                            start, end = pending.popleft()
+                        try:
+                            fetch_piece(f, start, end)
+                        except Exception as e:
+                            with lock:
+                                errors.append(e)
+                            return
+                        f.flush()
+                        with lock:
+                            part.mark_piece_done(start)
+            finally:
+                with lock:
+                    exited += 1
+                worker_exited.set()
+
+        workers: list[Thread] = []
+
+        def add_worker():
+            thread = Thread(target=worker, daemon=True)
+            thread.start()
+            workers.append(thread)
+
+        # start with one connection and add more while it pays off: when an
+        # extra connection no longer raises the total throughput, the link
+        # (not the per-connection throttling) is the limit
+        add_worker()
+        can_grow = True
+        best_rate = 0.0
+        last_downloaded, last_time = downloaded, time.monotonic()
+        while exited < len(workers):
+            worker_exited.wait(self.SEGMENTS_ADJUST_INTERVAL)
+            worker_exited.clear()
+            if not can_grow:
+                continue
+            now = time.monotonic()
+            with lock:
+                has_pending = len(pending) > 0
+                if now - last_time < self.SEGMENTS_ADJUST_INTERVAL:
+                    # woken by an exiting worker, too short to measure
+                    continue
+                rate = (downloaded - last_downloaded) / (now - last_time)
+                last_downloaded, last_time = downloaded, now
+            if not has_pending or len(errors) > 0:
+                continue
+            if len(workers) >= self.segments or rate < best_rate * 1.1:
+                can_grow = False
+                get_logger().debug(
+                    f"{self.filename}: using {len(workers)} connections"
+                )
+                continue
+            best_rate = rate
+            add_worker()
+        for thread in workers:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        # pieces arrive out of order, so the digests need a read pass here
+        self.__set_checksums(self.__hash_file(part.path))
+
+        return downloaded
+
+    @staticmethod
+    def __is_retryable(error: Exception) -> bool:
+        if not isinstance(error, requests.exceptions.HTTPError):
+            return True
+        response = error.response
+        return response is not None and response.status_code in Request.RETRY_STATUSES
+
+    def __get(self, headers: dict) -> requests.Response:
+        # interrupted transfers are resumed by download(), a retry inside
+        # Request would multiply the attempts
+        return Request.get(
+            self.url,
+            headers=headers,
+            stream=True,
+            source=self.source,
+            max_retries=0,
+        )
+
+    def __iter_chunks(self, response: requests.Response):
+        # like iter_content, but the chunk size follows the link speed
+        chunk_size = self.MIN_CHUNK_SIZE
+        while True:
+            started_at = time.monotonic()
+            try:
+                chunk = response.raw.read(chunk_size, decode_content=True)
+            except urllib3.exceptions.ProtocolError as e:
+                raise requests.exceptions.ChunkedEncodingError(e)
+            except urllib3.exceptions.ReadTimeoutError as e:
+                raise requests.exceptions.ConnectionError(e)
+            except urllib3.exceptions.DecodeError as e:
+                raise requests.exceptions.ContentDecodingError(e)
+            if not chunk:
+                return
+            # a throttled download slows down its reads, the shrinking
+            # chunks keep concurrent downloads taking turns
+            for bucket in self.throttles:
+                bucket.acquire(len(chunk))
+            elapsed = time.monotonic() - started_at
+            yield chunk
+            if elapsed < self.CHUNK_READ_TIME / 2:
+                chunk_size = min(chunk_size * 2, self.MAX_CHUNK_SIZE)
+            elif elapsed > self.CHUNK_READ_TIME * 2:
+                chunk_size = max(chunk_size // 2, self.MIN_CHUNK_SIZE)
+
+    def __report(self, downloaded: int, force: bool = False):
+        if self.on_chunk_received is None:
+            return
+        now = time.monotonic()
+        if not force and (
+            downloaded - self.__reported_size < self.PROGRESS_BYTES
+            or now - self.__reported_at < self.PROGRESS_INTERVAL
+        ):
+            return
+        self.__reported_size = downloaded
+        self.__reported_at = now
+        self.on_chunk_received(downloaded)
+
+    def __new_hashes(self) -> list:
+        return [hashlib.new(name) for name in self.digests]
+
+    def __hash_file(self, path: str) -> list:
+        hashes = self.__new_hashes()
+        if len(hashes) > 0:
+            with open(path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    for h in hashes:
+                        h.update(chunk)
+        return hashes
+
+    def __set_checksums(self, hashes: list):
+        self.checksums = {h.name: h.hexdigest() for h in hashes}
+
+    def __start(self, file_size: int):
+        if self.__started:
+            return
+        self.__started = True
+        if self.on_download_start is not None:
+            self.on_download_start(file_size)
+
+
+class Manifest:
+    # one manifest per output directory, shared by the download threads
+    FILENAME = "apkd-manifest.json"
+    __instances: dict[str, "Manifest"] = {}
+    __instances_lock = Lock()
+
+    path: str
+    __entries: dict[str, dict]
+    __lock: Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = Lock()
+        self.__entries = {}
+        try:
+            with open(path, "r") as f:
+                self.__entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def for_file(filename: str) -> "Manifest":
+        directory = os.path.dirname(os.path.abspath(filename))
+        with Manifest.__instances_lock:
+            manifest = Manifest.__instances.get(directory)
+            if manifest is None:
+                manifest = Manifest(os.path.join(directory, Manifest.FILENAME))
+                Manifest.__instances[directory] = manifest
+            return manifest
+
+    def is_present(self, filename: str, package: str, version_code: int) -> bool:
+        with self.__lock:
+            entry = self.__entries.get(os.path.basename(filename))
+        if entry is None:
+            return False
+        if entry["package"] != package or entry["version_code"] != version_code:
+            return False
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+
+        # the file was touched since it was recorded, compare the content
+        name, digest = next(iter(entry["digests"].items()), (None, None))
+        if name is None:
+            return False
+        h = hashlib.new(name)
+        with open(filename, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        if h.hexdigest() != digest:
+            return False
+        self.add(filename, package, version_code, entry["source"], entry["digests"])
+        return True
+
+    def add(
+        self,
+        filename: str,
+        package: str,
+        version_code: int,
+        source: str,
+        digests: dict[str, str],
+    ):
+        stat = os.stat(filename)
+        with self.__lock:
+            self.__entries[os.path.basename(filename)] = {
+                "package": package,
+                "version_code": version_code,
+                "source": source,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "digests": digests,
+            }
+            save_json(self.path, self.__entries, indent=2)
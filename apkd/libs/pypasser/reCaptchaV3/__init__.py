@@ -27,12 +27,14 @@ class reCaptchaV3:
         instance = super(reCaptchaV3, cls).__new__(cls)
         instance.__init__(*args,**kwargs)
 
-        cls.session = Session(BASE_URL, BASE_HEADERS, instance.timeout)
+        # A session per call, the class is shared between threads.
+        session = Session(BASE_URL, BASE_HEADERS, instance.timeout)
 
         data = parse_url(instance.anchor_url)
 
         # Gets recaptcha token.
-        token = cls.get_recaptcha_token(data['endpoint'],
+        token = cls.get_recaptcha_token(session,
+                                        data['endpoint'],
                                         data['params']
                                         )
 
@@ -42,7 +44,8 @@ class reCaptchaV3:
         post_data = POST_DATA.format(params["v"], token,
                                      params["k"], params["co"])
 
-        recaptcha_response = cls.get_recaptcha_response(data['endpoint'],
+        recaptcha_response = cls.get_recaptcha_response(session,
+                                                        data['endpoint'],
                                                         f'k={params["k"]}',
                                                         post_data
                                                         )
@@ -55,12 +58,12 @@ class reCaptchaV3:
         self.anchor_url = anchor_url
         self.timeout = timeout
 
-    def get_recaptcha_token(endpoint: str, params: str) -> str:
+    def get_recaptcha_token(session: Session, endpoint: str, params: str) -> str:
         """
         Sends GET request to `anchor URL` to get recaptcha token.
 
         """
-        response = reCaptchaV3.session.send_request(
+        response = session.send_request(
                                 f"{endpoint}/anchor", params=params)
 
         results = re.findall(r'"recaptcha-token" value="(.*?)"', response.text)
@@ -70,12 +73,12 @@ class reCaptchaV3:
         return results[0]
 
 
-    def get_recaptcha_response(endpoint: str, params: str, data: str) -> str:
+    def get_recaptcha_response(session: Session, endpoint: str, params: str, data: str) -> str:
         """
         Sends POST request to `reload URL` to get recaptcha response.
 
         """
-        response = reCaptchaV3.session.send_request(
+        response = session.send_request(
                                 f"{endpoint}/reload", data=data, params=params)
 
         results = re.findall(r'"rresp","(.*?)"', response.text)
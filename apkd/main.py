@@ -1,19 +1,23 @@
 import argparse
+import hashlib
+import importlib
 import logging
 import os
 import sys
-from functools import cmp_to_key
-from importlib import util as importutil
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import cmp_to_key, partial
 from queue import Empty as QueueEmpty
 from queue import Queue
 from threading import Lock, Thread
-from typing import Callable, Optional
-
-from prettytable import PrettyTable
-from tqdm import tqdm
+from typing import TYPE_CHECKING, Callable, Iterator, Optional, TypeVar
 
+from apkd.cache import MetadataCache
+from apkd.store import ContentStore
+from apkd.sync import Sync
 from apkd.utils import (
     App,
+    AppDetails,
     AppNotFoundError,
     AppVersion,
     BaseSource,
@@ -21,22 +25,44 @@ from apkd.utils import (
     get_logger,
 )
 
+if TYPE_CHECKING:
+    from prettytable import PrettyTable
+
 VERSION = "1.1.2"
 
+T = TypeVar("T")
+
 
 class Utils:
+    # built-in sources by their command line names; other packages can add
+    # theirs to the "apkd.sources" entry point group (a Source class or a
+    # module with one)
+    SOURCES = {
+        "apkcombo": "apkd.sources.apkcombo",
+        "apkpure": "apkd.sources.apkpure",
+        "appgallery": "apkd.sources.appgallery",
+        "fdroid": "apkd.sources.fdroid",
+        "nashstore": "apkd.sources.nashstore",
+        "rumarket": "apkd.sources.rumarket",
+        "rustore": "apkd.sources.rustore",
+    }
+    ENTRY_POINTS_GROUP = "apkd.sources"
+    __entry_points: Optional[dict] = None
+
     @staticmethod
-    def get_available_sources_names():
-        sources_path = os.path.join(os.path.dirname(__file__), "sources")
-        sources_names = []
-        for file in os.listdir(sources_path):
-            filename, fileext = os.path.splitext(file)
-            if fileext != ".py":
-                continue
-            sources_names.append(filename)
+    def get_available_sources_names(include_plugins: bool = True) -> list[str]:
+        sources_names = list(Utils.SOURCES)
+        if include_plugins:
+            sources_names += [
+                name for name in Utils.__get_entry_points() if name not in Utils.SOURCES
+            ]
 
         return sources_names
 
+    @staticmethod
+    def is_source_available(source_name: str) -> bool:
+        return source_name in Utils.SOURCES or source_name in Utils.__get_entry_points()
+
     @staticmethod
     def import_sources(
         sources_names: Optional[list[str]] = None,
@@ -44,28 +70,43 @@ class Utils:
         if sources_names is None:
             sources_names = Utils.get_available_sources_names()
 
-        sources_path = os.path.join(os.path.dirname(__file__), "sources")
-
         sources = {}
         for source_name in sources_names:
-            source_file = os.path.join(sources_path, f"{source_name}.py")
-            if not os.path.exists(source_file):
-                raise SourceImportError(f'Source "{source_name}" not found')
-            spec = importutil.spec_from_file_location(source_name, source_file)
-            if spec is None:
-                raise SourceImportError()
-            module = importutil.module_from_spec(spec)
-            if spec.loader is None:
-                raise SourceImportError()
-            spec.loader.exec_module(module)
-            sources[source_name] = module.Source()
+            if source_name in Utils.SOURCES:
+                source = importlib.import_module(Utils.SOURCES[source_name])
+            else:
+                entry_point = Utils.__get_entry_points().get(source_name)
+                if entry_point is None:
+                    raise SourceImportError(f'Source "{source_name}" not found')
+                try:
+                    source = entry_point.load()
+                except Exception as e:
+                    raise SourceImportError(
+                        f'Source "{source_name}" cannot be loaded: {e}'
+                    )
+            sources[source_name] = getattr(source, "Source", source)()
 
         return sources
 
+    @staticmethod
+    def __get_entry_points() -> dict:
+        # scanning the installed packages is slow, so it is done once and only
+        # when all the sources or one outside of the built-in ones are needed
+        if Utils.__entry_points is None:
+            from importlib.metadata import entry_points
+
+            Utils.__entry_points = {
+                entry_point.name.lower(): entry_point
+                for entry_point in entry_points(group=Utils.ENTRY_POINTS_GROUP)
+            }
+        return Utils.__entry_points
+
     @staticmethod
     def find_last_version(apps: list[App]) -> AppVersion | None:
         last_version: AppVersion | None = None
         for app in apps:
+            if len(app.get_versions()) == 0:
+                continue
             if (
                 last_version is not None
                 and last_version.code >= app.get_versions()[0].code
@@ -77,10 +118,32 @@ class Utils:
 
 
 class Apkd:
-    __sources: dict[str, BaseSource]
+    # how often submitted calls waiting for a free worker are checked for a start
+    QUEUED_CHECK_INTERVAL = 0.1
 
-    def __init__(self, auto_load_sources: bool = True):
+    __sources: dict[str, BaseSource]
+    __executor: ThreadPoolExecutor | None
+    __executor_lock: Lock
+    max_workers: int
+    source_timeout: float | None
+    cache: MetadataCache | None
+    store: ContentStore | None
+
+    def __init__(
+        self,
+        auto_load_sources: bool = True,
+        max_workers: int = 16,
+        source_timeout: float | None = 60,
+        cache: MetadataCache | None = None,
+        store: ContentStore | None = None,
+    ):
         self.__sources = {}
+        self.cache = cache
+        self.store = store
+        self.__executor = None
+        self.__executor_lock = Lock()
+        self.max_workers = max_workers
+        self.source_timeout = source_timeout
         if auto_load_sources:
             self.__load_sources()
 
@@ -101,12 +164,106 @@ class Apkd:
         sources = Utils.import_sources()
         self.__sources = sources
 
+    def close(self):
+        with self.__executor_lock:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=False, cancel_futures=True)
+                self.__executor = None
+
+    def __get_executor(self) -> ThreadPoolExecutor:
+        with self.__executor_lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="apkd"
+                )
+            return self.__executor
+
+    def __map_sources(
+        self, func: Callable[[BaseSource], T]
+    ) -> list[tuple[BaseSource, Future[T]]]:
+        sources = list(self.__sources.values())
+        done = dict(self.__iter_calls([(s, partial(func, s)) for s in sources]))
+        return [(s, done[i]) for i, s in enumerate(sources) if i in done]
+
+    def __iter_sources(
+        self, func: Callable[[BaseSource], T]
+    ) -> Iterator[tuple[BaseSource, Future[T]]]:
+        sources = list(self.__sources.values())
+        for i, future in self.__iter_calls([(s, partial(func, s)) for s in sources]):
+            yield sources[i], future
+
+    def __iter_calls(
+        self, calls: list[tuple[BaseSource, Callable[[], T]]]
+    ) -> Iterator[tuple[int, Future[T]]]:
+        # yields the indexes of the calls as they finish. At most max_workers
+        # calls are submitted at once, the next one when a slot frees up. The
+        # deadline of a call starts when a worker picks it up, the time spent
+        # queued behind other callers of the shared executor does not count
+        executor = self.__get_executor()
+        window = max(self.max_workers, 1)
+        sources = [source for source, _ in calls]
+        started_at: list[float | None] = [None] * len(calls)
+
+        def call(i: int) -> T:
+            started_at[i] = time.monotonic()
+            return calls[i][1]()
+
+        submitted: dict[Future[T], int] = {}
+        next_call = 0
+        try:
+            while True:
+                while next_call < len(calls) and len(submitted) < window:
+                    submitted[executor.submit(call, next_call)] = next_call
+                    next_call += 1
+                if len(submitted) == 0:
+                    break
+                timeout = None
+                if self.source_timeout is not None:
+                    now = time.monotonic()
+                    deadlines = []
+                    for future, i in list(submitted.items()):
+                        if started_at[i] is None:
+                            deadlines.append(now + self.QUEUED_CHECK_INTERVAL)
+                        elif now - started_at[i] >= self.source_timeout:
+                            # a running call cannot be interrupted, its result
+                            # is dropped and its slot given to the next call
+                            del submitted[future]
+                            get_logger().error(f"Error at {sources[i].name}: timed out")
+                        else:
+                            deadlines.append(started_at[i] + self.source_timeout)
+                    if len(deadlines) == 0:
+                        continue
+                    timeout = min(deadlines) - now
+                done, _ = wait(submitted, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield submitted.pop(future), future
+        finally:
+            # also when the caller stops early, calls not started are dropped
+            for future in submitted:
+                future.cancel()
+
+    def bootstrap(self):
+        # optional warm-up, otherwise every source sets itself up on first use
+        for source, future in self.__map_sources(lambda s: s.ensure_bootstrapped()):
+            if future.exception() is not None:
+                get_logger().error(f"Error at {source.name}: {future.exception()}")
+
     def get_app_info(self, package_name: str, versions_limit: int = -1) -> list[App]:
+        return self.__get_app_info(package_name, versions_limit, self.cache)
+
+    def __get_app_info(
+        self, package_name: str, versions_limit: int, cache: MetadataCache | None
+    ) -> list[App]:
         apps: list[App] = list()
 
-        for source in self.__sources.values():
+        def get_source_app_info(source: BaseSource) -> App:
+            if cache is None:
+                return source.get_app_info(package_name, versions_limit)
+            return cache.get_app_info(source, package_name, versions_limit)
+
+        for source, future in self.__map_sources(get_source_app_info):
             try:
-                app = source.get_app_info(package_name, versions_limit)
+                app = future.result()
             except AppNotFoundError:
                 continue
             except Exception as e:
@@ -119,6 +276,91 @@ class Apkd:
 
         return apps
 
+    def get_apps_info(
+        self, packages: list[str], versions_limit: int = -1
+    ) -> dict[str, list[App]]:
+        cache = self.cache
+        # batch-capable sources get a call per batch of packages, the others
+        # are looked up package by package on the executor; a failed batch
+        # loses only its own packages
+        calls: list[tuple[BaseSource, Callable[[], dict[str, App]]]] = []
+        for source in self.__sources.values():
+            if source.supports_batch:
+                for batch in source.split_batches(packages):
+                    if cache is None:
+                        func = partial(source.get_apps_info, batch, versions_limit)
+                    else:
+                        func = partial(
+                            cache.get_apps_info, source, batch, versions_limit
+                        )
+                    calls.append((source, func))
+                continue
+            for pkg in packages:
+                if cache is None:
+                    func = partial(source.get_app_info, pkg, versions_limit)
+                else:
+                    func = partial(cache.get_app_info, source, pkg, versions_limit)
+                calls.append((source, partial(self.__as_batch, pkg, func)))
+
+        found: dict[tuple[BaseSource, str], App] = {}
+        for i, future in self.__iter_calls(calls):
+            source = calls[i][0]
+            try:
+                for pkg, app in future.result().items():
+                    found[(source, pkg)] = app
+            except Exception as e:
+                get_logger().error(f"Error at {source.name}: {e}")
+
+        apps: dict[str, list[App]] = {}
+        for pkg in packages:
+            pkg_apps = [
+                found[(source, pkg)]
+                for source in self.__sources.values()
+                if (source, pkg) in found
+            ]
+            if len(pkg_apps) > 0:
+                apps[pkg] = pkg_apps
+
+        return apps
+
+    @staticmethod
+    def __as_batch(pkg: str, get_app_info: Callable[[], App]) -> dict[str, App]:
+        try:
+            return {pkg: get_app_info()}
+        except AppNotFoundError:
+            return {}
+
+    def resolve_version(self, package_name: str, version_code: int = -1) -> AppVersion:
+        if version_code == -1:
+            # only the newest version of every source is needed; the metadata
+            # cache is skipped because download links may be short-lived
+            apps = self.__get_app_info(package_name, 1, None)
+            last_version = Utils.find_last_version(apps)
+            if last_version is None:
+                raise AppNotFoundError(f"{package_name} not found")
+            return last_version
+
+        # first match wins, lookups which have not started yet are dropped
+        lookups = self.__iter_sources(lambda s: s.get_app_info(package_name))
+        try:
+            for source, future in lookups:
+                try:
+                    app = future.result()
+                except AppNotFoundError:
+                    continue
+                except Exception as e:
+                    get_logger().error(f"Error at {source.name}: {e}")
+                    continue
+                version = next(
+                    (v for v in app.get_versions() if v.code == version_code), None
+                )
+                if version is not None:
+                    return version
+        finally:
+            lookups.close()
+
+        raise AppNotFoundError(f"Version {version_code} not found")
+
     def download_app(
         self,
         package_name: str,
@@ -128,37 +370,62 @@ class Apkd:
         on_chunk_received: Callable[[int], None] | None = None,
         on_download_end: Callable[[int], None] | None = None,
     ) -> None:
-        apps = self.get_app_info(package_name)
-        if version_code != -1:
-            downloaded = False
-            for app in apps:
-                try:
-                    version = app.get_version_by_code(version_code)
-                    version.source.download_app(
-                        app.package,
-                        version,
-                        output_file,
-                        on_download_start,
-                        on_chunk_received,
-                        on_download_end,
-                    )
-                    downloaded = True
-                    break
-                except StopIteration:
-                    continue
-            if not downloaded:
-                raise AppNotFoundError(f"Version {version_code} not found")
-        else:
-            last_version = Utils.find_last_version(apps)
-            if last_version is not None:
-                last_version.source.download_app(
-                    package_name,
-                    last_version,
-                    output_file,
-                    on_download_start,
-                    on_chunk_received,
-                    on_download_end,
-                )
+        version = self.resolve_download(package_name, version_code, output_file)
+        if version is None:
+            return
+        self.download_version(
+            package_name,
+            version,
+            output_file,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+
+    def resolve_download(
+        self,
+        package_name: str,
+        version_code: int = -1,
+        output_file: Optional[str] = None,
+    ) -> AppVersion | None:
+        # None if the version is already in the store and has been linked
+        if (
+            self.store is not None
+            and version_code != -1
+            and self.store.link_existing(package_name, version_code, output_file)
+        ):
+            return None
+
+        return self.resolve_version(package_name, version_code)
+
+    def download_version(
+        self,
+        package_name: str,
+        version: AppVersion,
+        output_file: Optional[str] = None,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ) -> None:
+        if self.store is not None:
+            self.store.download_app(
+                package_name,
+                version,
+                output_file,
+                on_download_start,
+                on_chunk_received,
+                on_download_end,
+            )
+            return
+
+        version.source.download_app(
+            package_name,
+            version,
+            output_file,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
 
     def get_developer_id(self, package_name: str) -> set[tuple[BaseSource, str]]:
         developers: set[tuple[BaseSource, str]] = set()
@@ -176,6 +443,31 @@ class Apkd:
 
         return developers
 
+    def get_app_details(
+        self, package_name: str, versions_limit: int = -1
+    ) -> list[AppDetails]:
+        cache = self.cache
+
+        def get_source_app_details(source: BaseSource) -> AppDetails:
+            details = source.get_app_details(package_name, versions_limit)
+            if cache is not None:
+                cache.store(source, package_name, versions_limit, details.app)
+            return details
+
+        apps_details: list[AppDetails] = list()
+        for source, future in self.__map_sources(get_source_app_details):
+            try:
+                apps_details.append(future.result())
+            except AppNotFoundError:
+                continue
+            except Exception as e:
+                get_logger().error(f"Error at {source.name}: {e}")
+
+        if len(apps_details) == 0:
+            raise AppNotFoundError(f"{package_name} not found")
+
+        return apps_details
+
     def get_packages_from_developer(self, developer_id: str) -> set[str]:
         packages = set()
 
@@ -196,50 +488,173 @@ class SourceNotFoundError(FileNotFoundError):
     pass
 
 
-def download_apps(apkd: Apkd, queue: Queue, output_file: str):
+def create_progress_callbacks(
+    pkg: str,
+) -> tuple[
+    Callable[[AppVersion, int], None], Callable[[int], None], Callable[[int], None]
+]:
+    from tqdm import tqdm
+
+    bar: tqdm
+
+    def on_download_start(version: AppVersion, file_size: int):
+        nonlocal bar
+        bar = tqdm(
+            total=file_size,
+            unit="B",
+            unit_scale=True,
+            desc=f"{pkg} ver. {version.code} ({version.source.name})",
+            bar_format="{l_bar}{bar}{r_bar}",
+        )
+
+    def on_chunk_received(downloaded_size: int):
+        nonlocal bar
+        bar.n = downloaded_size
+        bar.update(0)
+
+    def on_download_end(_: int):
+        nonlocal bar
+        bar.close()
+
+    return on_download_start, on_chunk_received, on_download_end
+
+
+def add_versions_rows(
+    lock: Lock, table: "PrettyTable", pkg: str, apps: list[App] | None
+):
+    if apps is None:
+        not_available = "N/A"
+        with lock:
+            table.add_row(
+                [
+                    pkg,
+                    not_available,
+                    not_available,
+                    not_available,
+                    not_available,
+                    not_available,
+                ]
+            )
+        return
+
+    for app in apps:
+        version: AppVersion
+        for version in app.get_versions():
+            size_mb = version.size / (1024 * 1024)
+            with lock:
+                table.add_row(
+                    [
+                        app.package,
+                        version.source.name,
+                        version.name,
+                        version.code,
+                        version.update_date or "N/A",
+                        f"{size_mb:.2f} MB",
+                    ]
+                )
+
+
+def add_developers_rows(
+    lock: Lock,
+    table: "PrettyTable",
+    pkg: str,
+    developers: set[tuple[BaseSource, str]] | None,
+):
+    with lock:
+        if developers is None:
+            not_available = "N/A"
+            table.add_row([pkg, not_available, not_available])
+            return
+
+        for source, developer in developers:
+            table.add_row([pkg, source.name, developer])
+
+
+def resolve_apps(
+    resolve: Callable[[str, int], AppVersion | None], queue: Queue, downloads: Queue
+):
     while True:
         try:
             pkg, version_code = queue.get(block=False)
         except QueueEmpty:
             break
 
-        bar: tqdm
-
-        def on_download_start(version: AppVersion, file_size: int, pkg=pkg):
-            nonlocal bar
-            bar = tqdm(
-                total=file_size,
-                unit="B",
-                unit_scale=True,
-                desc=f"{pkg} ver. {version.code} ({version.source.name})",
-                bar_format="{l_bar}{bar}{r_bar}",
-            )
+        try:
+            version = resolve(pkg, version_code)
+            if version is not None:
+                # blocks while the download pool is busy
+                downloads.put((pkg, version))
+        except AppNotFoundError:
+            pass
+        except Exception as e:
+            get_logger().error(f'Error at resolve_apps for "{pkg}": {e}')
+        finally:
+            queue.task_done()
 
-        def on_chunk_received(downloaded_size: int):
-            nonlocal bar
-            bar.n = downloaded_size
-            bar.update(0)
 
-        def on_download_end(_: int):
-            nonlocal bar
-            bar.close()
+def download_versions(
+    download: Callable[
+        [
+            str,
+            AppVersion,
+            Callable[[AppVersion, int], None],
+            Callable[[int], None],
+            Callable[[int], None],
+        ],
+        None,
+    ],
+    downloads: Queue,
+):
+    while True:
+        item = downloads.get()
+        if item is None:
+            downloads.task_done()
+            break
 
+        pkg, version = item
         try:
-            apkd.download_app(
-                pkg,
-                version_code,
-                output_file,
-                on_download_start,
-                on_chunk_received,
-                on_download_end,
-            )
-        except AppNotFoundError:
-            pass
-        queue.task_done()
+            download(pkg, version, *create_progress_callbacks(pkg))
+        except Exception as e:
+            get_logger().error(f'Error at download_versions for "{pkg}": {e}')
+        finally:
+            downloads.task_done()
+
+
+def run_pipeline(
+    resolve: Callable[[str, int], AppVersion | None],
+    download: Callable[..., None],
+    queue: Queue,
+    jobs: int,
+    download_jobs: int,
+):
+    # metadata lookups (mostly waiting for slow pages) and transfers run in
+    # separate pools, the bounded queue keeps resolved versions from piling up
+    downloads: Queue = Queue(maxsize=download_jobs * 2)
+    resolvers = [
+        Thread(target=resolve_apps, args=(resolve, queue, downloads))
+        for _ in range(jobs)
+    ]
+    downloaders = [
+        Thread(target=download_versions, args=(download, downloads))
+        for _ in range(download_jobs)
+    ]
+    for thread in resolvers + downloaders:
+        thread.start()
+
+    for thread in resolvers:
+        thread.join()
+    for _ in downloaders:
+        downloads.put(None)
+    for thread in downloaders:
+        thread.join()
 
 
 def list_apps_versions(
-    lock: Lock, apkd: Apkd, queue: Queue, table: PrettyTable, versions_limit: int = -1
+    lock: Lock,
+    apkd: Apkd,
+    queue: Queue,
+    table: "PrettyTable",
+    versions_limit: int = -1,
 ):
     while True:
         try:
@@ -247,69 +662,80 @@ def list_apps_versions(
         except QueueEmpty:
             break
 
+        apps: list[App] | None = None
         try:
             apps = apkd.get_app_info(pkg, versions_limit)
         except Exception as e:
             if not isinstance(e, AppNotFoundError):
                 get_logger().error(f'Error at list_apps_versions for "{pkg}": {e}')
-            not_available = "N/A"
-            with lock:
-                table.add_row(
-                    [
-                        pkg,
-                        not_available,
-                        not_available,
-                        not_available,
-                        not_available,
-                        not_available,
-                    ]
-                )
-            queue.task_done()
-            continue
-
-        for app in apps:
-            version: AppVersion
-            for version in app.get_versions():
-                size_mb = version.size / (1024 * 1024)
-                with lock:
-                    table.add_row(
-                        [
-                            app.package,
-                            version.source.name,
-                            version.name,
-                            version.code,
-                            version.update_date or "N/A",
-                            f"{size_mb:.2f} MB",
-                        ]
-                    )
+        add_versions_rows(lock, table, pkg, apps)
 
         queue.task_done()
 
 
-def get_developer_id(lock: Lock, apkd: Apkd, queue: Queue, table: PrettyTable):
+def get_developer_id(lock: Lock, apkd: Apkd, queue: Queue, table: "PrettyTable"):
     while True:
         try:
             pkg, _ = queue.get(block=False)
         except QueueEmpty:
             break
 
+        developers: set[tuple[BaseSource, str]] | None = None
         try:
             developers = apkd.get_developer_id(pkg)
         except Exception:
-            not_available = "N/A"
-            with lock:
-                table.add_row([pkg, not_available, not_available])
-            queue.task_done()
-            continue
+            pass
+        add_developers_rows(lock, table, pkg, developers)
 
-        with lock:
-            for source, developer in developers:
-                table.add_row([pkg, source.name, developer])
+        queue.task_done()
+
+
+def add_details_rows(
+    lock: Lock,
+    versions_table: "PrettyTable",
+    developers_table: "PrettyTable",
+    pkg: str,
+    apps_details: list[AppDetails] | None,
+):
+    apps: list[App] | None = None
+    developers: set[tuple[BaseSource, str]] | None = None
+    if apps_details is not None:
+        apps = [details.app for details in apps_details]
+        developers = {
+            (details.app.source, details.developer_id)
+            for details in apps_details
+            if details.developer_id is not None
+        }
+    add_versions_rows(lock, versions_table, pkg, apps)
+    add_developers_rows(lock, developers_table, pkg, developers or None)
+
+
+def list_apps_details(
+    lock: Lock,
+    apkd: Apkd,
+    queue: Queue,
+    versions_table: "PrettyTable",
+    developers_table: "PrettyTable",
+):
+    # versions and developers of a package from the same store pages
+    while True:
+        try:
+            pkg, _ = queue.get(block=False)
+        except QueueEmpty:
+            break
+
+        apps_details: list[AppDetails] | None = None
+        try:
+            apps_details = apkd.get_app_details(pkg)
+        except Exception as e:
+            if not isinstance(e, AppNotFoundError):
+                get_logger().error(f'Error at list_apps_details for "{pkg}": {e}')
+        add_details_rows(lock, versions_table, developers_table, pkg, apps_details)
 
         queue.task_done()
 
 
-def divide_rows_by_pkg(table: PrettyTable):
+def divide_rows_by_pkg(table: "PrettyTable"):
     pkg = None
     for idx, row in enumerate(table.rows):
         if pkg is None:
@@ -325,7 +751,7 @@ def divide_rows_by_pkg(table: PrettyTable):
                 pkg = row[0]
 
 
-def divide_rows_by_source(table: PrettyTable):
+def divide_rows_by_source(table: "PrettyTable"):
     source = None
     for idx, row in enumerate(table.rows):
         if source is None:
@@ -339,9 +765,14 @@ def divide_rows_by_source(table: PrettyTable):
 def cli():
     get_logger().setLevel(logging.ERROR)
     apkd = Apkd(auto_load_sources=False)
-    sources_names = Utils.get_available_sources_names()
 
     parser = argparse.ArgumentParser("apkd")
+    parser.add_argument(
+        "mode",
+        help="sync: download only versions newer than the ones already fetched",
+        nargs="?",
+        choices=["sync"],
+    )
     parser.add_argument("--package", "-p", help="Package name", type=str)
     parser.add_argument(
         "--packages-list", "-l", help="File with package names", type=str
@@ -363,13 +794,146 @@ def cli():
     parser.add_argument(
         "--source",
         "-s",
-        help="Source",
+        help=f"Sources: {', '.join(Utils.get_available_sources_names(False))} "
+        "or installed plugins (default: all)",
         nargs="+",
         type=str.lower,
-        default=sources_names,
-        choices=sources_names,
     )
     parser.add_argument("--output", "-o", help="Output file", type=str)
+    parser.add_argument(
+        "--segments",
+        help="Max parallel connections per downloaded file",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--digest",
+        help="Checksums of downloaded files to write to the manifest",
+        nargs="+",
+        default=["sha256"],
+        # shake digests have no fixed length
+        choices=sorted(
+            a for a in hashlib.algorithms_guaranteed if not a.startswith("shake")
+        ),
+    )
+    parser.add_argument(
+        "--store",
+        help="Content-addressed store directory; downloads become links to it",
+        type=str,
+    )
+    parser.add_argument(
+        "--link",
+        help="How downloads are linked to the store",
+        choices=ContentStore.LINK_MODES,
+        default="hardlink",
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="Sync: directory of downloaded files",
+        type=str,
+        default=".",
+    )
+    parser.add_argument(
+        "--state",
+        help=f"Sync: state file (default: <output-dir>/{Sync.STATE_FILENAME})",
+        type=str,
+    )
+    parser.add_argument(
+        "--keep",
+        help="Sync: versions to keep per package, older ones are deleted (0 keeps all)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--refresh",
+        help="Ignore cached versions lists and fetch them again",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--offline",
+        help="Use only cached versions lists, without network requests",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-cache", help="Do not use the versions cache", action="store_true"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        help="Versions cache lifetime in seconds per source (e.g. apkpure=3600)",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="Max requests per second per source, 0 is unlimited (e.g. apkpure=1.5)",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        help="Max concurrent requests per source, 0 is unlimited (e.g. apkcombo=2)",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+    parser.add_argument(
+        "--limit-rate",
+        help="Total download rate of all downloads, e.g. 500K or 2M (bytes per second)",
+        type=str,
+    )
+    parser.add_argument(
+        "--limit-rate-source",
+        help="Download rate per source (e.g. apkpure=1M)",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+    parser.add_argument(
+        "--retries",
+        help="How many times a failed request or download is repeated per source "
+        "(e.g. rustore=5)",
+        nargs="+",
+        default=[],
+        type=str,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Request timeouts in seconds: READ or CONNECT READ",
+        nargs="+",
+        type=float,
+    )
+    parser.add_argument(
+        "--html-parser",
+        help="HTML parser of the source pages (default: lxml if installed)",
+        choices=["lxml", "html.parser"],
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        help="Process the packages with the asyncio engine",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="Max in-flight source requests of the asyncio engine",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Parallel metadata lookups (packages processed at once)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--download-jobs",
+        help="Parallel downloads, they run alongside the metadata lookups",
+        type=int,
+        default=3,
+    )
     parser.add_argument(
         "--verbose", "-v", help="Verbose logging", action="count", default=0
     )
@@ -392,17 +956,33 @@ def cli():
         logging_handler.setFormatter(logging.Formatter("%(message)s"))
         logger.addHandler(logging_handler)
 
-    if [args.list_versions, args.download, args.list_developers].count(True) == 0:
+    is_sync = args.mode == "sync"
+    if is_sync:
+        if [args.list_versions, args.download, args.list_developers].count(True) > 0:
+            parser.error(
+                "sync cannot be used with --list-versions/--download/--get-developer"
+            )
+        if not args.package and not args.packages_list and not args.developer_id:
+            parser.error(
+                "sync required one of --package/--packages-list/--developer-id option"
+            )
+        if args.output:
+            parser.error("sync uses --output-dir instead of --output")
+        if args.use_async:
+            parser.error("sync cannot be used with --async")
+    elif [args.list_versions, args.download, args.list_developers].count(True) == 0:
         parser.error(
             "At least one of --list-versions/--download/--get-developer is required"
         )
-    elif [args.list_versions, args.download, args.list_developers].count(True) > 1:
-        parser.error(
-            "--list-versions/--download/--get-developer cannot be used together"
-        )
+    elif args.download and (args.list_versions or args.list_developers):
+        parser.error("--download cannot be used with --list-versions/--get-developer")
 
-    if not args.download and args.version_code != -1:
+    if not args.download and not is_sync and args.version_code != -1:
         parser.error("--version-code can only be used with --download")
+    if args.keep < 0:
+        parser.error("--keep cannot be negative")
+    if args.jobs < 1 or args.download_jobs < 1:
+        parser.error("--jobs and --download-jobs must be positive")
 
     if args.list_versions and (
         not args.package and not args.packages_list and not args.developer_id
@@ -413,10 +993,94 @@ def cli():
     if args.list_developers and (not args.package and not args.packages_list):
         parser.error("--list-developers required one if --package/--packages-list option")
 
+    if args.refresh and args.offline:
+        parser.error("--refresh and --offline cannot be used together")
+    if args.offline and (not args.list_versions or args.list_developers):
+        parser.error("--offline can only be used with --list-versions")
+
+    from apkd.net import Bandwidth, Request
+
+    for source_name in args.source or []:
+        if not Utils.is_source_available(source_name):
+            sources_names = Utils.get_available_sources_names()
+            parser.error(
+                f"Unknown source: {source_name} (available: {', '.join(sources_names)})"
+            )
+
+    def parse_source_values(option: str, values: list[str], type: Callable) -> dict:
+        parsed = {}
+        for item in values:
+            source_name, _, value = item.partition("=")
+            try:
+                if not Utils.is_source_available(source_name.lower()):
+                    raise ValueError()
+                if type(value) < 0:
+                    raise ValueError()
+            except ValueError:
+                parser.error(f"Incorrect {option} value: {item}")
+            parsed[source_name.lower()] = type(value)
+        return parsed
+
+    cache_ttls = parse_source_values("--cache-ttl", args.cache_ttl, int)
+    rate_limits = parse_source_values("--rate-limit", args.rate_limit, float)
+    max_in_flight = parse_source_values("--max-in-flight", args.max_in_flight, int)
+    retries = parse_source_values("--retries", args.retries, int)
+    bandwidth_limits = parse_source_values(
+        "--limit-rate-source", args.limit_rate_source, Bandwidth.parse_rate
+    )
+    if args.limit_rate is not None:
+        try:
+            Bandwidth.set_limit(Bandwidth.parse_rate(args.limit_rate))
+        except ValueError:
+            parser.error(f"Incorrect --limit-rate value: {args.limit_rate}")
+
+    if args.timeout is not None:
+        if len(args.timeout) > 2 or min(args.timeout) <= 0:
+            parser.error("--timeout takes READ or CONNECT READ positive seconds")
+        connect_timeout, read_timeout = args.timeout[0], args.timeout[-1]
+        if len(args.timeout) == 1:
+            connect_timeout = min(Request.timeout[0], read_timeout)
+        Request.timeout = (connect_timeout, read_timeout)
+
+    if args.html_parser is not None:
+        from apkd.parsing import HtmlParser
+
+        try:
+            HtmlParser.set_backend(args.html_parser)
+        except ImportError:
+            parser.error("--html-parser lxml requires lxml (pip install apkd[lxml])")
+
     sources = Utils.import_sources(args.source)
     for source_name, source in sources.items():
+        if source_name in cache_ttls:
+            source.cache_ttl = cache_ttls[source_name]
+        if source_name in rate_limits:
+            source.rate_limit = rate_limits[source_name]
+        if source_name in max_in_flight:
+            source.max_in_flight = max_in_flight[source_name]
+        if source_name in retries:
+            source.max_retries = retries[source_name]
+            source.download_retries = retries[source_name]
+        if source_name in bandwidth_limits:
+            Bandwidth.set_limit(bandwidth_limits[source_name], source)
+        source.download_segments = args.segments
+        source.download_digests = tuple(args.digest)
         apkd.add_source(source_name, source)
 
+    # each of the --jobs packages is looked up in all the sources at once, the
+    # calls must not queue for workers (and run into their deadlines)
+    apkd.max_workers = max(apkd.max_workers, args.jobs * len(sources))
+
+    # every download job may hold up to --segments connections to one host
+    pool_maxsize = args.jobs + args.download_jobs * args.segments
+    if pool_maxsize > Request.pool_maxsize:
+        Request.configure(pool_maxsize=pool_maxsize)
+
+    if not args.no_cache:
+        apkd.cache = MetadataCache(refresh=args.refresh, offline=args.offline)
+    if args.store:
+        apkd.store = ContentStore(args.store, args.link)
+
     packages: set[tuple[str, int]] = set()
     if args.package:
         packages.add((args.package, args.version_code))
@@ -443,9 +1107,12 @@ def cli():
     for pkg in packages:
         q.put(pkg)
 
-    table: PrettyTable | None = None
+    versions_table: "PrettyTable | None" = None
+    developers_table: "PrettyTable | None" = None
+    if args.list_versions or args.list_developers:
+        from prettytable import PrettyTable
     if args.list_versions:
-        table = PrettyTable(
+        versions_table = PrettyTable(
             field_names=[
                 "Package",
                 "Source",
@@ -456,42 +1123,91 @@ def cli():
             ],
             align="l",
         )
-    elif args.list_developers:
-        table = PrettyTable(
+    if args.list_developers:
+        developers_table = PrettyTable(
             field_names=["Package", "Source", "Developer ID"], align="l"
         )
 
-    lock = Lock()
-    threads = set()
-    threads_count = 3
-    if len(packages) < 3:
-        threads_count = len(packages)
-    for _ in range(threads_count):
-        arguments = [apkd, q]
-        target = None
-        if args.download:
-            target = download_apps
-            arguments.append(args.output)
-        elif args.list_versions:
-            arguments.insert(0, lock)
-            arguments.append(table)
-            if args.developer_id:
-                arguments.append(1)
-            target = list_apps_versions
-        elif args.list_developers:
-            arguments.insert(0, lock)
-            arguments.append(table)
-            target = get_developer_id
-        thread = Thread(target=target, args=tuple(arguments))
-        thread.start()
-        threads.add(thread)
+    if args.use_async:
+        import asyncio
 
-    q.join()
-    for thread in threads:
-        thread.join()
+        from apkd.aio import AsyncApkd, run_async
+
+        async_apkd = AsyncApkd(
+            auto_load_sources=False,
+            concurrency=args.concurrency,
+            cache=apkd.cache,
+            store=apkd.store,
+        )
+        for source_name, source in apkd.get_sources().items():
+            async_apkd.add_source(source_name, source)
+        versions_limit = 1 if args.developer_id else -1
+        asyncio.run(
+            run_async(
+                async_apkd,
+                packages,
+                args,
+                versions_table,
+                developers_table,
+                versions_limit,
+            )
+        )
+    elif args.list_versions and args.packages_list and not args.list_developers:
+        assert versions_table is not None
+        # batch lookup, stores with multi-package endpoints answer the whole
+        # list with a few requests
+        packages_names = sorted({pkg for pkg, _ in packages})
+        apps = apkd.get_apps_info(packages_names)
+        lock = Lock()
+        for pkg in packages_names:
+            add_versions_rows(lock, versions_table, pkg, apps.get(pkg))
+    elif is_sync or args.download:
+        if is_sync:
+            sync = Sync(apkd, args.output_dir, args.state, args.keep)
+            resolve, download = sync.resolve, sync.fetch
+        else:
+
+            def resolve(pkg: str, version_code: int) -> AppVersion | None:
+                return apkd.resolve_download(pkg, version_code, args.output)
+
+            def download(pkg: str, version: AppVersion, *callbacks):
+                apkd.download_version(pkg, version, args.output, *callbacks)
+
+        run_pipeline(
+            resolve,
+            download,
+            q,
+            min(args.jobs, len(packages)),
+            min(args.download_jobs, len(packages)),
+        )
+    else:
+        lock = Lock()
+        threads = set()
+        threads_count = min(args.jobs, len(packages))
+        for _ in range(threads_count):
+            arguments = [lock, apkd, q]
+            target = None
+            if args.list_versions and args.list_developers:
+                arguments += [versions_table, developers_table]
+                target = list_apps_details
+            elif args.list_versions:
+                arguments.append(versions_table)
+                if args.developer_id:
+                    arguments.append(1)
+                target = list_apps_versions
+            elif args.list_developers:
+                arguments.append(developers_table)
+                target = get_developer_id
+            thread = Thread(target=target, args=tuple(arguments))
+            thread.start()
+            threads.add(thread)
+
+        q.join()
+        for thread in threads:
+            thread.join()
 
     if args.list_versions:
-        assert table is not None
+        assert versions_table is not None
 
         # sort table by "Source" + "Version code" columns
         def sort_by_pkg_and_vc(row1, row2):
@@ -516,11 +1232,11 @@ def cli():
                 else:
                     return row2[3] - row1[3]
 
-        table._rows.sort(key=cmp_to_key(sort_by_pkg_and_vc))
-        divide_rows_by_pkg(table)
-        print(table)
-    elif args.list_developers:
-        assert table is not None
+        versions_table._rows.sort(key=cmp_to_key(sort_by_pkg_and_vc))
+        divide_rows_by_pkg(versions_table)
+        print(versions_table)
+    if args.list_developers:
+        assert developers_table is not None
 
         # sort table by "Source" column
         def sort(row1, row2):
@@ -530,6 +1246,13 @@ def cli():
                 return -1
             return row2[1] < row1[1]
 
-        table._rows.sort(key=cmp_to_key(sort))
-        divide_rows_by_pkg(table)
-        print(table)
+        developers_table._rows.sort(key=cmp_to_key(sort))
+        divide_rows_by_pkg(developers_table)
+        print(developers_table)
+
+    retries_stats = Request.get_retries_stats()
+    if len(retries_stats) > 0:
+        get_logger().warning(
+            "Retried requests: "
+            + ", ".join(f"{name}: {n}" for name, n in sorted(retries_stats.items()))
+        )
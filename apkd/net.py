@@ -0,0 +1,498 @@
+import json
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock, Semaphore
+from typing import TYPE_CHECKING, Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+import requests.adapters
+
+from apkd.utils import BaseSource, get_cache_dir, get_logger, save_json
+
+if TYPE_CHECKING:
+    import cloudscraper
+
+
+class Request:
+    pool_connections: int = 10
+    pool_maxsize: int = 10
+    keep_alive: bool = True
+    # (connect, read) timeouts in seconds of requests without an explicit one
+    timeout: tuple[float, float] = (10, 30)
+    # retries of requests which are not made on behalf of a source
+    max_retries: int = 2
+    # base and max delay of the exponential backoff between retries
+    backoff_base: float = 0.5
+    backoff_max: float = 30
+    # longest Retry-After that is waited out before the request is repeated
+    max_retry_after: float = 5 * 60
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("get", "head", "options", "put", "delete")
+    __sessions: dict[str, requests.Session] = {}
+    __sessions_lock = Lock()
+    __scrapers: dict[str, "CloudflareScraper"] = {}
+    __retries: dict[str, int] = {}
+    __retries_lock = Lock()
+
+    @staticmethod
+    def get(
+        url,
+        params=None,
+        use_cloudscraper: bool = False,
+        source: Optional[BaseSource] = None,
+        max_retries: Optional[int] = None,
+        **kwargs,
+    ):
+        kwargs.setdefault("timeout", Request.timeout)
+
+        def send() -> requests.Response:
+            if use_cloudscraper:
+                return Request.scraper(url).request("get", url, params, **kwargs)
+            session = Request.session(url)
+            return session.request("get", url, params, **kwargs)
+
+        return Request.__send("get", url, send, source, max_retries)
+
+    @staticmethod
+    def post(
+        url,
+        data=None,
+        json=None,
+        source: Optional[BaseSource] = None,
+        max_retries: Optional[int] = None,
+        **kwargs,
+    ):
+        kwargs.setdefault("timeout", Request.timeout)
+
+        def send() -> requests.Response:
+            session = Request.session(url)
+            return session.request("post", url, data=data, json=json, **kwargs)
+
+        return Request.__send("post", url, send, source, max_retries)
+
+    @staticmethod
+    def get_retries_stats() -> dict[str, int]:
+        # retries made so far, by source name (or host for other requests)
+        with Request.__retries_lock:
+            return dict(Request.__retries)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        # "full jitter", so that workers failed at once do not retry at once
+        return random.uniform(
+            0, min(Request.backoff_max, Request.backoff_base * 2**attempt)
+        )
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> float | None:
+        if response.status_code not in (429, 503):
+            return None
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def session(url: Optional[str] = None) -> requests.Session:
+        # one long-lived session per host, shared by all threads, so that
+        # connections (and TLS handshakes) are reused between requests
+        key = urlparse(url).netloc.lower() if url else ""
+        with Request.__sessions_lock:
+            session = Request.__sessions.get(key)
+            if session is None:
+                session = Request.__new_session()
+                Request.__sessions[key] = session
+        return session
+
+    @staticmethod
+    def scraper(url: str) -> "CloudflareScraper":
+        host = urlparse(url).netloc.lower()
+        with Request.__sessions_lock:
+            scraper = Request.__scrapers.get(host)
+            if scraper is None:
+                scraper = CloudflareScraper(host)
+                Request.__scrapers[host] = scraper
+        return scraper
+
+    @staticmethod
+    def configure(
+        pool_connections: Optional[int] = None,
+        pool_maxsize: Optional[int] = None,
+        keep_alive: Optional[bool] = None,
+    ):
+        if pool_connections is not None:
+            Request.pool_connections = pool_connections
+        if pool_maxsize is not None:
+            Request.pool_maxsize = pool_maxsize
+        if keep_alive is not None:
+            Request.keep_alive = keep_alive
+        # sessions created with the old settings are dropped
+        Request.close()
+
+    @staticmethod
+    def close():
+        with Request.__sessions_lock:
+            sessions = list(Request.__sessions.values())
+            sessions += [s.scraper for s in Request.__scrapers.values()]
+            Request.__sessions.clear()
+            Request.__scrapers.clear()
+        for session in sessions:
+            session.close()
+
+    @staticmethod
+    def __send(
+        method: str,
+        url: str,
+        send: Callable[[], requests.Response],
+        source: Optional[BaseSource],
+        max_retries: Optional[int],
+    ) -> requests.Response:
+        if max_retries is None:
+            max_retries = Request.max_retries
+            if source is not None:
+                max_retries = source.max_retries
+        name = source.name if source is not None else urlparse(url).netloc.lower()
+        attempt = 0
+        while True:
+            try:
+                if source is None:
+                    response = send()
+                else:
+                    response = source.get_limiter().request(send)
+            except requests.exceptions.RequestException as e:
+                # a request which never reached the server is safe to repeat
+                if attempt >= max_retries or not (
+                    isinstance(e, requests.exceptions.ConnectTimeout)
+                    or (
+                        method in Request.IDEMPOTENT_METHODS
+                        and isinstance(
+                            e,
+                            (
+                                requests.exceptions.ConnectionError,
+                                requests.exceptions.Timeout,
+                            ),
+                        )
+                    )
+                ):
+                    raise
+                error = str(e)
+                delay = Request.backoff(attempt)
+            else:
+                # a 429 is not processed by the server, so any method is repeated
+                if (
+                    attempt >= max_retries
+                    or response.status_code not in Request.RETRY_STATUSES
+                    or (
+                        method not in Request.IDEMPOTENT_METHODS
+                        and response.status_code != 429
+                    )
+                ):
+                    return response
+                retry_after = Request.retry_after(response)
+                if retry_after is not None and retry_after > Request.max_retry_after:
+                    return response
+                response.close()
+                error = f"HTTP {response.status_code}"
+                delay = retry_after
+                if delay is None:
+                    delay = Request.backoff(attempt)
+                elif source is not None:
+                    # the whole source waits, not only this request
+                    source.get_limiter().bucket.block(delay)
+
+            attempt += 1
+            with Request.__retries_lock:
+                Request.__retries[name] = Request.__retries.get(name, 0) + 1
+            get_logger().warning(
+                f"{name}: {error}, retry {attempt}/{max_retries} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+    @staticmethod
+    def __new_session() -> requests.Session:
+        session = requests.Session()
+        if not Request.keep_alive:
+            session.headers["Connection"] = "close"
+        Request.__set_middleware(
+            session,
+            RequestsMiddleware(
+                pool_connections=Request.pool_connections,
+                pool_maxsize=Request.pool_maxsize,
+            ),
+        )
+        return session
+
+    @staticmethod
+    def __set_middleware(
+        session: requests.Session, middleware: requests.adapters.HTTPAdapter
+    ):
+        session.mount("http://", middleware)
+        session.mount("https://", middleware)
+
+
+class TokenBucket:
+    # "rate" tokens are added per second, up to "capacity"; a rate of 0
+    # disables the limit. Requests larger than the capacity are let through
+    # once the bucket is full and leave it in debt
+    rate: float
+    capacity: float
+    __tokens: float
+    __updated_at: float
+    __blocked_until: float
+    __lock: Lock
+
+    def __init__(self, rate: float = 0, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__updated_at = time.monotonic()
+        self.__blocked_until = 0
+        self.__lock = Lock()
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None):
+        with self.__lock:
+            self.__refill(time.monotonic())
+            self.rate = rate
+            if capacity is not None:
+                self.capacity = capacity
+            self.__tokens = min(self.__tokens, self.capacity)
+
+    def acquire(self, tokens: float = 1):
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                delay = self.__blocked_until - now
+                if delay <= 0:
+                    if self.rate <= 0:
+                        return
+                    self.__refill(now)
+                    needed = min(tokens, self.capacity)
+                    if self.__tokens >= needed:
+                        self.__tokens -= tokens
+                        return
+                    delay = (needed - self.__tokens) / self.rate
+            # re-checked at least every second, the rate may change meanwhile
+            time.sleep(min(delay, 1.0))
+
+    def block(self, seconds: float):
+        with self.__lock:
+            self.__blocked_until = max(
+                self.__blocked_until, time.monotonic() + seconds
+            )
+
+    def __refill(self, now: float):
+        if self.rate > 0:
+            self.__tokens = min(
+                self.capacity, self.__tokens + (now - self.__updated_at) * self.rate
+            )
+        self.__updated_at = now
+
+
+class Bandwidth:
+    # download rate limits in bytes per second, 0 means no limit. The global
+    # limit is shared by all downloads, sources may have their own on top
+    # of it; both can be changed while downloads are running
+    BURST_SECONDS = 0.25
+    __global = TokenBucket()
+
+    @staticmethod
+    def set_limit(rate: float, source: Optional[BaseSource] = None):
+        if source is None:
+            bucket = Bandwidth.__global
+        else:
+            source.bandwidth_limit = rate
+            bucket = source.get_bandwidth_bucket()
+        bucket.set_rate(rate, Bandwidth.burst(rate))
+
+    @staticmethod
+    def get_limit() -> float:
+        return Bandwidth.__global.rate
+
+    @staticmethod
+    def get_buckets(source: Optional[BaseSource] = None) -> tuple[TokenBucket, ...]:
+        if source is None:
+            return (Bandwidth.__global,)
+        return (Bandwidth.__global, source.get_bandwidth_bucket())
+
+    @staticmethod
+    def burst(rate: float) -> float:
+        # small enough to keep the rate smooth, large enough for one read
+        return max(rate * Bandwidth.BURST_SECONDS, 64 * 1024)
+
+    @staticmethod
+    def parse_rate(value: str) -> float:
+        # "500K", "2M", "1.5G" or plain bytes per second
+        units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+        value = value.strip().upper().removesuffix("B")
+        multiplier = units.get(value[-1:], 1)
+        if multiplier != 1:
+            value = value[:-1]
+        return float(value) * multiplier
+
+
+class SourceLimiter:
+    bucket: TokenBucket
+    __in_flight: Semaphore | None
+
+    def __init__(self, rate_limit: float = 0, burst: int = 1, max_in_flight: int = 0):
+        self.bucket = TokenBucket(rate_limit, max(burst, 1))
+        self.__in_flight = Semaphore(max_in_flight) if max_in_flight > 0 else None
+
+    def request(self, send: Callable[[], requests.Response]) -> requests.Response:
+        if self.__in_flight is None:
+            self.bucket.acquire()
+            return send()
+        with self.__in_flight:
+            self.bucket.acquire()
+            return send()
+
+
+class CloudflareScraper:
+    # cookies which Cloudflare issues after a passed challenge; they are bound
+    # to the User-Agent that solved it, so the agent is persisted with them
+    CLEARANCE_COOKIES = ("cf_clearance", "__cf_bm")
+
+    host: str
+    scraper: "cloudscraper.CloudScraper"
+    user_agent: Optional[str]
+    __cache: "ClearanceCache"
+    __lock: Lock
+    __valid_until: float
+
+    def __init__(self, host: str):
+        # only ApkPure needs it, and it is slow to import
+        import cloudscraper
+
+        self.host = host
+        self.scraper = cloudscraper.create_scraper()
+        self.__cache = ClearanceCache.instance()
+        self.__lock = Lock()
+        self.user_agent, cookies = self.__cache.load(host)
+        for cookie in cookies:
+            self.scraper.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+        self.__valid_until = self.__clearance_expiry()
+
+    def request(self, method: str, url: str, params=None, **kwargs):
+        if self.user_agent is not None:
+            kwargs["headers"] = (kwargs.get("headers") or {}) | {
+                "User-Agent": self.user_agent
+            }
+        if time.time() < self.__valid_until:
+            return self.__request(method, url, params, **kwargs)
+        # no valid clearance yet: let a single thread pass the challenge,
+        # the others wait and then reuse its cookies
+        with self.__lock:
+            response = self.__request(method, url, params, **kwargs)
+            self.__valid_until = self.__clearance_expiry() or float("inf")
+        return response
+
+    def __request(self, method: str, url: str, params=None, **kwargs):
+        response = self.scraper.request(method, url, params, **kwargs)
+        if self.user_agent is None:
+            self.user_agent = response.request.headers.get("User-Agent")
+        self.__cache.save(self.host, self.user_agent, self.__persistent_cookies())
+        return response
+
+    def __persistent_cookies(self) -> list[dict]:
+        now = time.time()
+        return [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "expires": cookie.expires,
+                "secure": cookie.secure,
+            }
+            for cookie in self.scraper.cookies
+            if cookie.expires is not None and cookie.expires > now
+        ]
+
+    def __clearance_expiry(self) -> float:
+        now = time.time()
+        expires = [
+            cookie.expires
+            for cookie in self.scraper.cookies
+            if cookie.name in self.CLEARANCE_COOKIES
+            and cookie.expires is not None
+            and cookie.expires > now
+        ]
+        return min(expires) if expires else 0
+
+
+class ClearanceCache:
+    __instance: Optional["ClearanceCache"] = None
+    __instance_lock = Lock()
+
+    path: str
+    __entries: dict[str, dict]
+    __lock: Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = Lock()
+        self.__entries = {}
+        try:
+            with open(path, "r") as f:
+                self.__entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def instance() -> "ClearanceCache":
+        with ClearanceCache.__instance_lock:
+            if ClearanceCache.__instance is None:
+                ClearanceCache.__instance = ClearanceCache(
+                    os.path.join(get_cache_dir(), "cloudflare.json")
+                )
+            return ClearanceCache.__instance
+
+    def load(self, host: str) -> tuple[Optional[str], list[dict]]:
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(host, {})
+        cookies = [c for c in entry.get("cookies", []) if c["expires"] > now]
+        if len(cookies) == 0:
+            # clearance has expired, a new challenge may use another agent
+            return None, []
+        return entry.get("user_agent"), cookies
+
+    def save(self, host: str, user_agent: Optional[str], cookies: list[dict]):
+        entry = {"user_agent": user_agent, "cookies": cookies}
+        with self.__lock:
+            if self.__entries.get(host) == entry:
+                return
+            self.__entries[host] = entry
+            try:
+                save_json(self.path, self.__entries)
+            except OSError as e:
+                get_logger().warning(f"Unable to save Cloudflare clearance: {e}")
+
+
+class RequestsMiddleware(requests.adapters.HTTPAdapter):
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: None | float | tuple[float, float] | tuple[float, None] = None,
+        verify: bool | str = True,
+        cert: None | bytes | str | tuple[bytes | str, bytes | str] = None,
+        proxies=None,
+    ) -> requests.Response:
+        response = super().send(request, stream, timeout, verify, cert, proxies)
+        log_request(response.request, response)
+        return response
+
+
+def log_request(request: requests.PreparedRequest, response: requests.Response):
+    get_logger().debug(f"Request: {request.url}, response code: {response.status_code}")
@@ -0,0 +1,51 @@
+from typing import Optional
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+class HtmlParser:
+    # lxml is optional (pip install apkd[lxml]) and used when installed
+    BACKENDS = ("lxml", "html.parser")
+
+    __backend: Optional[str] = None
+
+    @staticmethod
+    def get_backend() -> str:
+        if HtmlParser.__backend is None:
+            try:
+                import lxml  # noqa: F401
+
+                HtmlParser.__backend = "lxml"
+            except ImportError:
+                HtmlParser.__backend = "html.parser"
+        return HtmlParser.__backend
+
+    @staticmethod
+    def set_backend(backend: str):
+        if backend not in HtmlParser.BACKENDS:
+            raise ValueError(f"Unknown HTML parser: {backend}")
+        if backend == "lxml":
+            import lxml  # noqa: F401
+        HtmlParser.__backend = backend
+
+    @staticmethod
+    def parse(html: str, *only: tuple[str, str]) -> BeautifulSoup:
+        # only the (tag, class) elements and their children are built,
+        # the rest of the page is skipped by the tokenizer
+        parse_only = None
+        if len(only) > 0:
+            parse_only = SoupStrainer(HtmlParser.__matcher(only))
+        return BeautifulSoup(
+            html, features=HtmlParser.get_backend(), parse_only=parse_only
+        )
+
+    @staticmethod
+    def __matcher(only: tuple[tuple[str, str], ...]):
+        def matches(name: str, attrs: Optional[dict]) -> bool:
+            classes = (attrs or {}).get("class") or []
+            # not split into a list yet while the page is being parsed
+            if isinstance(classes, str):
+                classes = classes.split()
+            return any(name == tag and cls in classes for tag, cls in only)
+
+        return matches
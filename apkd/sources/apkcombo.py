@@ -2,19 +2,34 @@ from bs4 import BeautifulSoup, Tag
 from user_agent import generate_user_agent
 
 from apkd.libs.pypasser import reCaptchaV3
+from apkd.parsing import HtmlParser
 from apkd.utils import (
     App,
+    AppDetails,
     AppNotFoundError,
     AppVersion,
     BaseSource,
     Request,
+    TokenPool,
     get_logger,
 )
 
+RECAPTCHA_ANCHOR_URL = "https://www.google.com/recaptcha/api2/anchor?ar=1&k=6LffOIUUAAAAACDGY5pUGox0yBGBUvRD8aT8c2J0&co=aHR0cHM6Ly9hcGtjb21iby5jb206NDQz&hl=en&v=QquE1_MNjnFHgZF4HPsEcf_2&size=invisible&cb=kuyn1i99ewi2"
+
 
 class Source(BaseSource):
     headers: dict
-    checkin: str
+    checkins: TokenPool[str]
+    recaptcha_tokens: TokenPool[str]
+    # lifetimes in seconds; reCaptcha v3 tokens are valid for two minutes
+    checkin_ttl: float = 30 * 60
+    recaptcha_ttl: float = 110
+    # tokens kept at once, parallel lookups spread over them
+    recaptcha_pool_size: int = 2
+    # faster clients get 429 responses
+    rate_limit = 2
+    rate_burst = 2
+    max_in_flight = 4
 
     def __init__(self):
         super().__init__()
@@ -26,20 +41,84 @@ class Source(BaseSource):
             "Accept-Language": "en-US;q=0.5",
             "Referer": "https://apkcombo.com/ru/downloader/",
         }
-        response = Request.post("https://apkcombo.com/checkin", headers=self.headers)
-        self.checkin = response.text
-        self.recaptcha_token = reCaptchaV3(
-            "https://www.google.com/recaptcha/api2/anchor?ar=1&k=6LffOIUUAAAAACDGY5pUGox0yBGBUvRD8aT8c2J0&co=aHR0cHM6Ly9hcGtjb21iby5jb206NDQz&hl=en&v=QquE1_MNjnFHgZF4HPsEcf_2&size=invisible&cb=kuyn1i99ewi2"
+        self.checkins = TokenPool(
+            self.__fetch_checkin, self.checkin_ttl, name="ApkCombo checkin"
+        )
+        self.recaptcha_tokens = TokenPool(
+            self.__fetch_recaptcha_token,
+            self.recaptcha_ttl,
+            self.recaptcha_pool_size,
+            name="ApkCombo reCaptcha token",
+        )
+
+    @property
+    def checkin(self) -> str:
+        return self.checkins.acquire()
+
+    @property
+    def recaptcha_token(self) -> str:
+        return self.recaptcha_tokens.acquire()
+
+    def bootstrap(self):
+        # the first token, later ones are renewed in the background; the
+        # checkin is needed for downloads only and is fetched by the first one
+        self.recaptcha_tokens.acquire()
+
+    def __fetch_checkin(self) -> str:
+        response = Request.post(
+            "https://apkcombo.com/checkin", headers=self.headers, source=self
         )
+        response.raise_for_status()
+        return response.text
+
+    @staticmethod
+    def __fetch_recaptcha_token() -> str:
+        return reCaptchaV3(RECAPTCHA_ANCHOR_URL)
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
         app: App = super().get_app_info(pkg, versions_limit)
+        soup = HtmlParser.parse(self.__get_downloader_page(pkg), ("a", "variant"))
+
+        return self.__get_app(app, soup)
+
+    def get_developer_id(self, package_name: str) -> str | None:
         response = Request.get(
-            f"https://apkcombo.com/ru/downloader/?package={pkg}&ajax=1",
-            headers=self.headers | {"token": self.recaptcha_token},
+            f"https://apkcombo.com/ru/downloader/?package={package_name}&ajax=1",
+            headers=self.headers,
+            source=self,
         )
         html_code = response.text
-        soup = BeautifulSoup(html_code, features="html.parser")
+        soup = HtmlParser.parse(html_code, ("div", "author"))
+
+        return self.__get_developer_id(soup)
+
+    def get_app_details(self, pkg: str, versions_limit: int = -1) -> AppDetails:
+        app: App = super().get_app_info(pkg, versions_limit)
+        soup = HtmlParser.parse(
+            self.__get_downloader_page(pkg), ("a", "variant"), ("div", "author")
+        )
+
+        return AppDetails(self.__get_app(app, soup), self.__get_developer_id(soup))
+
+    def __get_downloader_page(self, pkg: str) -> str:
+        self.ensure_bootstrapped()
+        for _ in range(2):
+            token = self.recaptcha_token
+            response = Request.get(
+                f"https://apkcombo.com/ru/downloader/?package={pkg}&ajax=1",
+                headers=self.headers | {"token": token},
+                source=self,
+            )
+            if response.status_code not in (401, 403):
+                break
+            # a rejected token is dropped and the page asked once more with
+            # a fresh one
+            self.recaptcha_tokens.invalidate(token)
+
+        return response.text
+
+    def __get_app(self, app: App, soup: BeautifulSoup) -> App:
+        pkg = app.package
         versions: list[AppVersion] = []
         for block in soup.find_all("a", class_="variant"):
             type_apk = None
@@ -62,7 +141,8 @@ class Source(BaseSource):
                 int(version_code),
                 file_size,
                 self,
-                download_link=f"{download_url}&{self.checkin}",
+                # signed with a checkin that is still valid at download time
+                link_resolver=lambda _, url=download_url: f"{url}&{self.checkin}",
             )
             versions.append(version)
             if self.is_versions_limit(versions):
@@ -75,13 +155,8 @@ class Source(BaseSource):
 
         return app
 
-    def get_developer_id(self, package_name: str) -> str | None:
-        response = Request.get(
-            f"https://apkcombo.com/ru/downloader/?package={package_name}&ajax=1",
-            headers=self.headers,
-        )
-        html_code = response.text
-        soup = BeautifulSoup(html_code, features="html.parser")
+    @staticmethod
+    def __get_developer_id(soup: BeautifulSoup) -> str | None:
         developer_id = None
         author = soup.find("div", class_="author")
         if isinstance(author, Tag):
@@ -95,10 +170,12 @@ class Source(BaseSource):
         packages = set()
 
         response = Request.get(
-            f"https://apkcombo.com/developer/{developer_id}", headers=self.headers
+            f"https://apkcombo.com/developer/{developer_id}",
+            headers=self.headers,
+            source=self,
         )
         html_code = response.text
-        soup = BeautifulSoup(html_code, features="html.parser")
+        soup = HtmlParser.parse(html_code, ("a", "l_item"))
         for item in soup.find_all("a", class_="l_item"):
             if not isinstance(item, Tag):
                 continue
@@ -1,14 +1,27 @@
 import datetime
+import json
+import os
+from threading import Lock
 from typing import cast
 
 from bs4 import BeautifulSoup, Tag
 from user_agent import generate_user_agent
 
-from apkd.utils import App, AppNotFoundError, AppVersion, BaseSource, Request
+from apkd.parsing import HtmlParser
+from apkd.utils import (App, AppDetails, AppNotFoundError, AppVersion, BaseSource, DeferredJsonWriter, Request,
+                        get_cache_dir)
 
 
 class Source(BaseSource):
     headers: dict
+    # Cloudflare answers faster clients with challenge pages
+    rate_limit = 2
+    rate_burst = 4
+    max_in_flight = 4
+    # {"<package>": "<app page url>"}, saves the search request on later lookups
+    __app_urls: dict[str, str] | None
+    __app_urls_lock: Lock
+    __app_urls_writer: DeferredJsonWriter
 
     def __init__(self) -> None:
         super().__init__()
@@ -20,28 +33,25 @@ class Source(BaseSource):
             'Accept-Language': 'en-US;q=0.5',
             'Referer': 'https://apkpure.com/',
         }
+        self.__app_urls = None
+        self.__app_urls_lock = Lock()
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
         app: App = super().get_app_info(pkg, versions_limit)
-        response = Request.get(
-            f'https://apkpure.com/search?q={pkg}', use_cloudscraper=True, headers=self.headers)
-        html_code = response.text
-        soup = BeautifulSoup(html_code, features='html.parser')
-        div_first_apk = soup.find('div', class_='first')
-        if div_first_apk is None:
-            raise AppNotFoundError()
-        div_first_apk = cast(Tag, div_first_apk)
-        web_pkg = div_first_apk.get('data-dt-app')
-        if web_pkg != pkg:
-            raise AppNotFoundError()
-        url_block = div_first_apk.find('a', class_='first-info')
-        url_block = cast(Tag, url_block)
-        url = url_block.get('href')
-        url = cast(str, url)
+        soup = HtmlParser.parse(self.__get_versions_page(pkg), ('a', 'ver_download_link'))
+        return self.__get_app(app, soup)
 
-        response = Request.get(f'{url}/versions', use_cloudscraper=True, headers=self.headers)
-        html_code = response.text
-        soup = BeautifulSoup(html_code, features='html.parser')
+    def get_developer_id(self, package_name: str) -> str | None:
+        soup = HtmlParser.parse(self.__get_versions_page(package_name), ('p', 'ver_dev'))
+        return self.__get_developer_id(soup)
+
+    def get_app_details(self, pkg: str, versions_limit: int = -1) -> AppDetails:
+        app: App = super().get_app_info(pkg, versions_limit)
+        soup = HtmlParser.parse(self.__get_versions_page(pkg), ('a', 'ver_download_link'), ('p', 'ver_dev'))
+        return AppDetails(self.__get_app(app, soup), self.__get_developer_id(soup))
+
+    def __get_app(self, app: App, soup: BeautifulSoup) -> App:
+        pkg = app.package
         versions: list[AppVersion] = []
         for block in soup.find_all('a', class_='ver_download_link'):
             block = cast(Tag, block)
@@ -78,42 +88,88 @@ class Source(BaseSource):
 
         return app
 
-    def get_developer_id(self, package_name: str) -> str | None:
+    @staticmethod
+    def __get_developer_id(soup: BeautifulSoup) -> str | None:
+        developer_id = None
+        ver_dev = soup.find('p', class_='ver_dev')
+        if isinstance(ver_dev, Tag):
+            ver_dev_a = ver_dev.find('a')
+            if isinstance(ver_dev_a, Tag):
+                developer_id = ver_dev_a.text.strip()
+
+        return developer_id
+
+    def __get_versions_page(self, pkg: str) -> str:
+        url = self.__get_app_urls().get(pkg)
+        from_index = url is not None
+        if url is None:
+            url = self.__search_app_url(pkg)
+        response = Request.get(f'{url}/versions', use_cloudscraper=True, headers=self.headers, source=self)
+        if response.status_code == 404 and from_index:
+            # the app page has moved, look it up again
+            self.__set_app_url(pkg, None)
+            url = self.__search_app_url(pkg)
+            response = Request.get(f'{url}/versions', use_cloudscraper=True, headers=self.headers, source=self)
+        if response.status_code == 404:
+            self.__set_app_url(pkg, None)
+            raise AppNotFoundError()
+        self.__set_app_url(pkg, url)
+
+        return response.text
+
+    def __search_app_url(self, pkg: str) -> str:
         response = Request.get(
-            f'https://apkpure.com/search?q={package_name}', use_cloudscraper=True, headers=self.headers)
+            f'https://apkpure.com/search?q={pkg}', use_cloudscraper=True, headers=self.headers, source=self)
         html_code = response.text
-        soup = BeautifulSoup(html_code, features='html.parser')
+        soup = HtmlParser.parse(html_code, ('div', 'first'))
         div_first_apk = soup.find('div', class_='first')
         if div_first_apk is None:
             raise AppNotFoundError()
         div_first_apk = cast(Tag, div_first_apk)
         web_pkg = div_first_apk.get('data-dt-app')
-        if web_pkg != package_name:
+        if web_pkg != pkg:
             raise AppNotFoundError()
         url_block = div_first_apk.find('a', class_='first-info')
         url_block = cast(Tag, url_block)
         url = url_block.get('href')
-        url = cast(str, url)
-
-        response = Request.get(f'{url}/versions', use_cloudscraper=True, headers=self.headers)
-        html_code = response.text
-        soup = BeautifulSoup(html_code, features='html.parser')
-        developer_id = None
-        ver_dev = soup.find('p', class_='ver_dev')
-        if isinstance(ver_dev, Tag):
-            ver_dev_a = ver_dev.find('a')
-            if isinstance(ver_dev_a, Tag):
-                developer_id = ver_dev_a.text.strip()
 
-        return developer_id
+        return cast(str, url)
+
+    def __get_app_urls(self) -> dict[str, str]:
+        with self.__app_urls_lock:
+            if self.__app_urls is None:
+                index_path = os.path.join(get_cache_dir(), 'apkpure-urls.json')
+                try:
+                    with open(index_path, 'r') as f:
+                        self.__app_urls = json.load(f)
+                except (OSError, ValueError):
+                    self.__app_urls = {}
+                # saved in batches, a long run would rewrite it for every package
+                self.__app_urls_writer = DeferredJsonWriter(index_path, self.__snapshot_app_urls)
+            return self.__app_urls
+
+    def __set_app_url(self, pkg: str, url: str | None):
+        app_urls = self.__get_app_urls()
+        with self.__app_urls_lock:
+            if app_urls.get(pkg) == url:
+                return
+            if url is None:
+                del app_urls[pkg]
+            else:
+                app_urls[pkg] = url
+        self.__app_urls_writer.changed()
+
+    def __snapshot_app_urls(self) -> dict[str, str]:
+        with self.__app_urls_lock:
+            return dict(self.__app_urls or {})
 
     def find_packages_from_developer(self, developer_id: str) -> set[str]:
         packages = set()
 
         response = Request.get(
-            f'https://apkpure.com/developer/{developer_id}', use_cloudscraper=True, headers=self.headers)
+            f'https://apkpure.com/developer/{developer_id}', use_cloudscraper=True, headers=self.headers, source=self)
         html_code = response.text
-        soup = BeautifulSoup(html_code, features='html.parser')
+        soup = HtmlParser.parse(html_code, ('p', 'search-title'))
         for item in soup.find_all('p', class_='search-title'):
             if not isinstance(item, Tag):
                 continue
@@ -58,7 +58,7 @@ class Source(BaseSource):
                 'installType': ''
             }),
             'ver': '1.1'
-        }))
+        }), source=self)
         json_code = response.json()
         if 'titleType' not in json_code or json_code['titleType'] is None:
             raise AppNotFoundError()
@@ -1,14 +1,26 @@
+import gzip
+import json
+import os
+import time
+from threading import Lock
 from typing import cast
-from datetime import datetime
+from datetime import datetime, timezone
 
 from user_agent import generate_user_agent
-from bs4 import BeautifulSoup, Tag
+from bs4 import Tag
 
-from apkd.utils import App, AppNotFoundError, AppVersion, BaseSource, Request
+from apkd.parsing import HtmlParser
+from apkd.utils import App, AppNotFoundError, AppVersion, BaseSource, Request, get_cache_dir, get_logger, save_json
 
 
 class Source(BaseSource):
     headers: dict
+    repo_url = 'https://f-droid.org/repo'
+    # how long the local index is trusted before it is revalidated
+    index_ttl: int = 60 * 60
+    use_index: bool = True
+    __index: dict | None
+    __index_lock: Lock
 
     def __init__(self) -> None:
         super().__init__()
@@ -19,14 +31,100 @@ class Source(BaseSource):
             'Accept-Language': 'ru,en-US;q=0.5',
             'User-Agent': generate_user_agent()
         }
+        self.__index = None
+        self.__index_lock = Lock()
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
+        index = None
+        if self.use_index:
+            try:
+                index = self.get_index()
+            except Exception as e:
+                get_logger().warning(f'F-Droid: index is not available, fallback to the package page: {e}')
+        if index is None:
+            return self.__get_app_info_from_page(pkg, versions_limit)
+
+        app: App = super().get_app_info(pkg, versions_limit)
+        if pkg not in index:
+            raise AppNotFoundError()
+        versions: list[AppVersion] = []
+        for version_name, version_code, file_size, added, apk_name in index[pkg]:
+            update_date = None
+            if added is not None:
+                update_date = datetime.fromtimestamp(added / 1000, timezone.utc).strftime('%d.%m.%Y')
+            download_link = f'{self.repo_url}/{apk_name}'
+            versions.append(AppVersion(version_name, version_code, file_size, self, update_date, download_link))
+            if self.is_versions_limit(versions):
+                break
+
+        app.set_versions(versions)
+        return app
+
+    def get_index(self) -> dict[str, list]:
+        with self.__index_lock:
+            index_path = os.path.join(get_cache_dir(), 'fdroid-index.json.gz')
+            local_index = self.__index
+            if local_index is None:
+                local_index = self.__load_local_index(index_path)
+            if local_index is not None and time.time() - local_index['checked_at'] < self.index_ttl:
+                self.__index = local_index
+                return local_index['packages']
+
+            headers = self.headers.copy()
+            if local_index is not None:
+                if local_index['etag']:
+                    headers['If-None-Match'] = local_index['etag']
+                if local_index['last_modified']:
+                    headers['If-Modified-Since'] = local_index['last_modified']
+            response = Request.get(f'{self.repo_url}/index-v1.json', headers=headers, source=self)
+            if response.status_code == 304 and local_index is not None:
+                local_index['checked_at'] = time.time()
+            else:
+                response.raise_for_status()
+                local_index = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'checked_at': time.time(),
+                    'packages': self.__compact_index(response.json()),
+                }
+            self.__save_local_index(index_path, local_index)
+            self.__index = local_index
+
+            return local_index['packages']
+
+    @staticmethod
+    def __compact_index(index: dict) -> dict[str, list]:
+        # keep only the fields needed for AppVersion, newest versions first
+        packages = {}
+        for pkg, versions in index['packages'].items():
+            packages[pkg] = [
+                [v.get('versionName', ''), v['versionCode'], v.get('size', 0), v.get('added'), v['apkName']]
+                for v in sorted(versions, key=lambda v: v['versionCode'], reverse=True)
+            ]
+        return packages
+
+    @staticmethod
+    def __load_local_index(index_path: str) -> dict | None:
+        try:
+            with gzip.open(index_path, 'rt') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def __save_local_index(index_path: str, local_index: dict):
+        try:
+            save_json(index_path, local_index, compress=True)
+        except OSError as e:
+            get_logger().warning(f'F-Droid: unable to save the index: {e}')
+
+    def __get_app_info_from_page(self, pkg: str, versions_limit: int = -1) -> App:
         app: App = super().get_app_info(pkg, versions_limit)
         response = Request.get(
-            f'https://f-droid.org/en/packages/{pkg}', headers=self.headers)
+            f'https://f-droid.org/en/packages/{pkg}', headers=self.headers, source=self)
         if response.status_code == 404:
             raise AppNotFoundError()
-        soup = BeautifulSoup(response.text, features='html.parser')
+        soup = HtmlParser.parse(response.text, ('li', 'package-version'))
         versions: list[AppVersion] = []
         block: Tag
         for block in soup.find_all('li', class_='package-version'):
@@ -52,4 +150,4 @@ class Source(BaseSource):
                 break
 
         app.set_versions(versions)
-        return app
\ No newline at end of file
+        return app
@@ -8,6 +8,9 @@ import random
 
 class Source(BaseSource):
     headers: dict
+    supports_batch = True
+    # packages per profile/updates request
+    batch_size: int = 50
 
     def __init__(self) -> None:
         super().__init__()
@@ -37,19 +40,41 @@ class Source(BaseSource):
         }
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
-        app: App = super().get_app_info(pkg, versions_limit)
-        response = Request.post(
-            'https://store.nashstore.ru/api/mobile/v1/profile/updates', headers=self.headers, data=json.dumps({
-                "apps": {
-                    f"{pkg}": {
-                        "packageName": f"{pkg}"
-                    }
-                }
-            }))
-        json_code = response.json()
-        if 'list' not in json_code or len(json_code['list']) != 1:
+        apps = self.get_apps_info([pkg], versions_limit)
+        if pkg not in apps:
             raise AppNotFoundError()
-        app_json = json_code['list'][0]
+        return apps[pkg]
+
+    def get_apps_info(self, packages: list[str], versions_limit: int = -1) -> dict[str, App]:
+        apps: dict[str, App] = {}
+        for chunk in self.split_batches(packages):
+            response = Request.post(
+                'https://store.nashstore.ru/api/mobile/v1/profile/updates', headers=self.headers, data=json.dumps({
+                    "apps": {
+                        f"{pkg}": {
+                            "packageName": f"{pkg}"
+                        } for pkg in chunk
+                    }
+                }), source=self)
+            # an error body must not turn into "not found" for the whole chunk
+            response.raise_for_status()
+            json_code = response.json()
+            if 'list' not in json_code:
+                raise ValueError(f'Unexpected response: {response.text[:200]}')
+            app_list = json_code['list']
+            for app_json in app_list:
+                pkg = app_json.get('package_name')
+                # a single package request does not rely on the echoed package name
+                if len(chunk) == 1 and len(app_list) == 1:
+                    pkg = chunk[0]
+                if pkg not in chunk:
+                    continue
+                apps[pkg] = self.__parse_app(pkg, app_json, versions_limit)
+
+        return apps
+
+    def __parse_app(self, pkg: str, app_json: dict, versions_limit: int) -> App:
+        app: App = super().get_app_info(pkg, versions_limit)
         version_code = app_json['release']['version_code']
         version = app_json['release']['version_name']
         update_date = app_json['release']['create_at']
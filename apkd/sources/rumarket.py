@@ -23,7 +23,7 @@ class Source(BaseSource):
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
         app: App = super().get_app_info(pkg, versions_limit)
         response = Request.get(
-            f'https://store-api.ruplay.market/api/v1/app/getApp/{pkg}', headers=self.headers)
+            f'https://store-api.ruplay.market/api/v1/app/getApp/{pkg}', headers=self.headers, source=self)
         if response.status_code == 404:
             raise AppNotFoundError()
         json_code = response.json()
@@ -2,7 +2,7 @@ from datetime import datetime
 
 from user_agent import generate_user_agent
 
-from apkd.utils import (App, AppNotFoundError, AppVersion, BaseSource,
+from apkd.utils import (App, AppDetails, AppNotFoundError, AppVersion, BaseSource,
                         DeveloperNotFoundError, Request)
 
 
@@ -27,18 +27,41 @@ class Source(BaseSource):
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> App:
         app: App = super().get_app_info(pkg, versions_limit)
+        return self.__get_app(app, self.__get_overall_info(pkg))
+
+    def get_app_details(self, pkg: str, versions_limit: int = -1) -> AppDetails:
+        app: App = super().get_app_info(pkg, versions_limit)
+        overall_info = self.__get_overall_info(pkg)
+        return AppDetails(
+            self.__get_app(app, overall_info),
+            overall_info['publicCompanyId'],
+            {'name': overall_info.get('appName'), 'company': overall_info.get('companyName')}
+        )
+
+    def __get_overall_info(self, pkg: str) -> dict:
         response = Request.get(
-            f'https://backapi.rustore.ru/applicationData/overallInfo/{pkg}', headers=self.headers)
+            f'https://backapi.rustore.ru/applicationData/overallInfo/{pkg}', headers=self.headers, source=self)
         json_code = response.json()
         if 'code' not in json_code or json_code['code'] != 'OK':
             raise AppNotFoundError()
-        version_code = json_code['body']['versionCode']
-        version = json_code['body']['versionName'].split('-rustore')[0]
-        update_date = json_code['body']['appVerUpdatedAt']
+
+        return json_code['body']
+
+    def __get_app(self, app: App, overall_info: dict) -> App:
+        version_code = overall_info['versionCode']
+        version = overall_info['versionName'].split('-rustore')[0]
+        update_date = overall_info['appVerUpdatedAt']
         update_date = datetime.strptime(
             update_date, '%Y-%m-%dT%H:%M:%S.%f%z').strftime('%m.%d.%Y')
 
-        app_id = json_code['body']['appId']
+        app_id = overall_info['appId']
+        # the link costs a second request, it is asked for only on download
+        app.set_versions([AppVersion(
+            version, version_code, overall_info.get('fileSize', 0), self, update_date,
+            link_resolver=lambda v: self.__get_download_link(app.package, app_id, v))])
+        return app
+
+    def __get_download_link(self, pkg: str, app_id: int, version: AppVersion) -> str:
         response = Request.post('https://backapi.rustore.ru/applicationData/v2/download-link', json={
             "appId": app_id,
             "firstInstall": True,
@@ -49,24 +72,17 @@ class Source(BaseSource):
             "sdkVersion": 30,
             "withoutSplits": True,
             "signatureFingerprint": None,
-        }, headers=self.headers)
+        }, headers=self.headers, source=self)
         json_code = response.json()
         if 'code' not in json_code or json_code['code'] != 'OK':
             raise FileNotFoundError(f'Package {pkg} not found')
         download_url = json_code['body']['downloadUrls'][0]['url']
-        file_size = json_code['body']['downloadUrls'][0]['size']
+        version.size = json_code['body']['downloadUrls'][0]['size']
 
-        app.set_versions(
-            [AppVersion(version, version_code, file_size, self, update_date, download_url)])
-        return app
+        return download_url
 
     def get_developer_id(self, package_name: str) -> str|None:
-        response = Request.get(
-            f'https://backapi.rustore.ru/applicationData/overallInfo/{package_name}', headers=self.headers)
-        json_code = response.json()
-        if 'code' not in json_code or json_code['code'] != 'OK':
-            raise AppNotFoundError()
-        developer_id = json_code['body']['publicCompanyId']
+        developer_id = self.__get_overall_info(package_name)['publicCompanyId']
 
         return developer_id
 
@@ -74,7 +90,7 @@ class Source(BaseSource):
         packages = set()
 
         response = Request.get(
-            f'https://backapi.rustore.ru/applicationData/devs/{developer_id}/apps?limit=999999', headers=self.headers)
+            f'https://backapi.rustore.ru/applicationData/devs/{developer_id}/apps?limit=999999', headers=self.headers, source=self)
         json_code = response.json()
         if 'code' not in json_code or json_code['code'] != 'OK':
             raise DeveloperNotFoundError()
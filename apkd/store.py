@@ -0,0 +1,157 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+from threading import Lock
+from typing import Callable, Optional
+
+from apkd.utils import AppVersion, get_logger
+
+
+class ContentStore:
+    # blobs are stored by their SHA-256 as "<path>/blobs/ab/abcdef....apk",
+    # downloaded files are links to them
+    LINK_MODES = ("hardlink", "symlink")
+
+    path: str
+    link_mode: str
+    __connection: sqlite3.Connection
+    __lock: Lock
+    __version_locks: dict[tuple[str, int], Lock]
+
+    def __init__(self, path: str, link_mode: str = "hardlink"):
+        if link_mode not in self.LINK_MODES:
+            raise ValueError(f"Unknown link mode: {link_mode}")
+        self.path = path
+        self.link_mode = link_mode
+        self.__lock = Lock()
+        self.__version_locks = {}
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+        self.__connection = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False
+        )
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "source TEXT NOT NULL, "
+                "package TEXT NOT NULL, "
+                "version_code INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, "
+                "PRIMARY KEY (source, package, version_code))"
+            )
+
+    def find(self, package: str, version_code: int) -> tuple[str, str] | None:
+        # any source will do, the same version is stored only once
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT sha256, source FROM blobs "
+                "WHERE package = ? AND version_code = ?",
+                (package, version_code),
+            ).fetchall()
+        for sha256, source_name in rows:
+            if os.path.exists(self.blob_path(sha256)):
+                return sha256, source_name
+        return None
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.path, "blobs", sha256[:2], f"{sha256}.apk")
+
+    def link_existing(
+        self, package: str, version_code: int, output_file: Optional[str] = None
+    ) -> bool:
+        found = self.find(package, version_code)
+        if found is None:
+            return False
+        from apkd.download import Manifest
+
+        sha256, source_name = found
+        filename = output_file or f"{package}_{version_code}.apk"
+        self.__link(sha256, filename)
+        Manifest.for_file(filename).add(
+            filename, package, version_code, source_name, {"sha256": sha256}
+        )
+        return True
+
+    def download_app(
+        self,
+        pkg: str,
+        version: AppVersion,
+        output_file: Optional[str] = None,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ):
+        source = version.source
+        filename = output_file or f"{pkg}_{version.code}.apk"
+        with self.__version_lock(pkg, version.code):
+            found = self.find(pkg, version.code)
+            if found is None:
+                tmp_path = os.path.join(
+                    self.path, "tmp", f"{pkg}_{version.code}_{source.name}.apk"
+                )
+
+                def mitm_on_download_start(file_size: int):
+                    if on_download_start is None:
+                        return
+                    on_download_start(version, file_size)
+
+                checksums = source.download_file(
+                    source.get_download_link(pkg, version),
+                    source.headers,
+                    tmp_path,
+                    version.size,
+                    mitm_on_download_start,
+                    on_chunk_received,
+                    on_download_end,
+                )
+                sha256 = checksums.get("sha256") or self.__hash_file(tmp_path)
+                blob_path = self.blob_path(sha256)
+                if os.path.exists(blob_path):
+                    # the same bytes were already fetched for another version
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(tmp_path, blob_path)
+                with self.__lock, self.__connection:
+                    self.__connection.execute(
+                        "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                        (source.name, pkg, version.code, sha256),
+                    )
+            else:
+                sha256 = found[0]
+                get_logger().info(f"{pkg} ver. {version.code} is already in the store")
+
+        from apkd.download import Manifest
+
+        self.__link(sha256, filename)
+        Manifest.for_file(filename).add(
+            filename, pkg, version.code, source.name, {"sha256": sha256}
+        )
+
+    def __version_lock(self, package: str, version_code: int) -> Lock:
+        with self.__lock:
+            return self.__version_locks.setdefault((package, version_code), Lock())
+
+    def __link(self, sha256: str, filename: str):
+        blob_path = self.blob_path(sha256)
+        if os.path.lexists(filename):
+            if os.path.exists(filename) and os.path.samefile(blob_path, filename):
+                return
+            os.remove(filename)
+        try:
+            if self.link_mode == "hardlink":
+                os.link(blob_path, filename)
+            else:
+                os.symlink(os.path.abspath(blob_path), filename)
+        except OSError as e:
+            # e.g. hardlinks across filesystems
+            get_logger().warning(f"Unable to link {filename} ({e}), copying it")
+            shutil.copyfile(blob_path, filename)
+
+    @staticmethod
+    def __hash_file(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        return h.hexdigest()
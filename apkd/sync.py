@@ -0,0 +1,160 @@
+import json
+import os
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Optional
+
+from apkd.utils import AppVersion, get_logger, save_json
+
+if TYPE_CHECKING:
+    from apkd.main import Apkd
+
+
+class SyncState:
+    # {"<package>": [{"code": ..., "name": ..., "source": ..., "file": ...}]},
+    # newest versions first, "file" is relative to the sync output directory
+    path: str
+    __packages: dict[str, list[dict]]
+    __lock: Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = Lock()
+        self.__packages = {}
+        try:
+            with open(path, "r") as f:
+                self.__packages = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get_versions(self, package: str) -> list[dict]:
+        with self.__lock:
+            return list(self.__packages.get(package, []))
+
+    def add(self, package: str, version: AppVersion, filename: str):
+        with self.__lock:
+            versions = [
+                v for v in self.__packages.get(package, []) if v["code"] != version.code
+            ]
+            versions.append(
+                {
+                    "code": version.code,
+                    "name": version.name,
+                    "source": version.source.name,
+                    "file": filename,
+                }
+            )
+            versions.sort(key=lambda v: v["code"], reverse=True)
+            self.__packages[package] = versions
+            self.__save()
+
+    def remove(self, package: str, codes: set[int]):
+        with self.__lock:
+            self.__packages[package] = [
+                v for v in self.__packages.get(package, []) if v["code"] not in codes
+            ]
+            self.__save()
+
+    def __save(self):
+        save_json(self.path, self.__packages, indent=2)
+
+
+class Sync:
+    STATE_FILENAME = "apkd-sync.json"
+
+    apkd: "Apkd"
+    output_dir: str
+    keep: int
+    state: SyncState
+
+    def __init__(
+        self,
+        apkd: "Apkd",
+        output_dir: str = ".",
+        state_path: Optional[str] = None,
+        keep: int = 0,
+    ):
+        self.apkd = apkd
+        self.output_dir = output_dir
+        # 0 keeps every fetched version
+        self.keep = keep
+        os.makedirs(output_dir, exist_ok=True)
+        self.state = SyncState(
+            state_path or os.path.join(output_dir, self.STATE_FILENAME)
+        )
+
+    def sync_package(
+        self,
+        package_name: str,
+        version_code: int = -1,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ) -> AppVersion | None:
+        version = self.resolve(package_name, version_code)
+        if version is None:
+            return None
+        self.fetch(
+            package_name,
+            version,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+
+        return version
+
+    def resolve(self, package_name: str, version_code: int = -1) -> AppVersion | None:
+        # None if the package is up to date
+        local_versions = self.state.get_versions(package_name)
+        if version_code != -1:
+            codes = [v["code"] for v in local_versions]
+            if version_code in codes:
+                return None
+            # would be pruned right after the download
+            if self.keep > 0 and sum(c > version_code for c in codes) >= self.keep:
+                get_logger().info(
+                    f"{package_name}: {version_code} is older than the "
+                    f"{self.keep} kept versions, skipped"
+                )
+                return None
+
+        version = self.apkd.resolve_version(package_name, version_code)
+        if version_code == -1 and len(local_versions) > 0:
+            if version.code <= local_versions[0]["code"]:
+                return None
+
+        return version
+
+    def fetch(
+        self,
+        package_name: str,
+        version: AppVersion,
+        on_download_start: Callable[[AppVersion, int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ):
+        name = f"{package_name}_{version.code}.apk"
+        self.apkd.download_version(
+            package_name,
+            version,
+            os.path.join(self.output_dir, name),
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+        self.state.add(package_name, version, name)
+        self.prune(package_name)
+
+    def prune(self, package_name: str):
+        if self.keep <= 0:
+            return
+        removed: set[int] = set()
+        for version in self.state.get_versions(package_name)[self.keep :]:
+            # older states stored the path as given, files are always in output_dir
+            filename = os.path.join(self.output_dir, os.path.basename(version["file"]))
+            if os.path.lexists(filename):
+                os.remove(filename)
+                get_logger().info(f"Pruned {filename}")
+            removed.add(version["code"])
+        if len(removed) > 0:
+            self.state.remove(package_name, removed)
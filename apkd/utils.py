@@ -1,20 +1,91 @@
+import atexit
+import json
 import logging
-from typing import Callable, Optional
+import os
+import time
+from threading import Condition, Lock, Thread, Timer, get_ident, local
+from typing import TYPE_CHECKING, Callable, Generic, Optional, TypeVar
 
-import cloudscraper
-import requests
-import requests.adapters
+if TYPE_CHECKING:
+    from apkd.net import SourceLimiter, TokenBucket
+
+# the network layer (requests) is slow to import, it is loaded on first use;
+# the names stay importable from here
+NET_NAMES = (
+    "Bandwidth",
+    "ClearanceCache",
+    "CloudflareScraper",
+    "Request",
+    "RequestsMiddleware",
+    "SourceLimiter",
+    "TokenBucket",
+    "log_request",
+)
+
+
+T = TypeVar("T")
+
+
+def __getattr__(name: str):
+    if name in NET_NAMES:
+        import apkd.net
+
+        return getattr(apkd.net, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class BaseSource:
     name: str
     headers: dict
-    __versions_limit: int = -1
+    # lifetime of cached versions lists, in seconds
+    cache_ttl: int = 6 * 60 * 60
+    # get_apps_info looks up many packages with few requests, at most
+    # batch_size per call
+    supports_batch: bool = False
+    batch_size: int = 50
+    # how many times an interrupted download is resumed
+    download_retries: int = 3
+    # max parallel connections per file when the server supports ranges
+    download_segments: int = 1
+    # checksums written to the manifest of the output directory
+    download_digests: tuple[str, ...] = ("sha256",)
+    # requests per second to the store (0 means no limit) and how many of
+    # them may go at once after an idle period
+    rate_limit: float = 0
+    rate_burst: int = 1
+    # max concurrent requests to the store, 0 means no limit
+    max_in_flight: int = 0
+    # how many times a failed request to the store is repeated
+    max_retries: int = 2
+    # download rate from the store in bytes per second, 0 means no limit;
+    # Bandwidth.set_limit changes it at runtime
+    bandwidth_limit: float = 0
+    __limiter: "SourceLimiter"
+    __bandwidth: "TokenBucket"
+    __bootstrap_lock: Lock
+    __bootstrapped: bool
+    __lazy_lock = Lock()
+    # sources are shared between threads, so the limit of the current call
+    # is kept per thread
+    __call_state = local()
 
     def get_app_info(self, pkg: str, versions_limit: int = -1) -> "App":
-        self.__versions_limit = versions_limit
+        self.__call_state.versions_limit = versions_limit
         return App(pkg, self)
 
+    def get_apps_info(
+        self, packages: list[str], versions_limit: int = -1
+    ) -> dict[str, "App"]:
+        apps: dict[str, App] = {}
+        for pkg in packages:
+            try:
+                apps[pkg] = self.get_app_info(pkg, versions_limit)
+            except AppNotFoundError:
+                continue
+            except Exception as e:
+                get_logger().error(f"Error at {self.name}: {e}")
+        return apps
+
     def download_app(
         self,
         pkg: str,
@@ -24,14 +95,20 @@ class BaseSource:
         on_chunk_received: Callable[[int], None] | None = None,
         on_download_end: Callable[[int], None] | None = None,
     ):
+        from apkd.download import Manifest
+
         filename = output_file or f"{pkg}_{version.code}.apk"
+        manifest = Manifest.for_file(filename)
+        if manifest.is_present(filename, pkg, version.code):
+            get_logger().info(f"{filename} is already downloaded")
+            return
 
         def mitm_on_download_start(file_size: int):
             if on_download_start is None:
                 return
             on_download_start(version, file_size)
 
-        self.download_file(
+        checksums = self.download_file(
             self.get_download_link(pkg, version),
             self.headers,
             filename,
@@ -40,6 +117,7 @@ class BaseSource:
             on_chunk_received,
             on_download_end,
         )
+        manifest.add(filename, pkg, version.code, self.name, checksums)
 
     def download_file(
         self,
@@ -50,24 +128,72 @@ class BaseSource:
         on_download_start: Callable[[int], None] | None = None,
         on_chunk_received: Callable[[int], None] | None = None,
         on_download_end: Callable[[int], None] | None = None,
-    ):
-        with Request.get(url, headers=headers, stream=True) as r:
-            if "Content-Length" in r.headers:
-                file_size = int(r.headers["Content-Length"])
-
-            if on_download_start is not None:
-                on_download_start(file_size)
-
-            r.raise_for_status()
-            with open(filename, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    if on_chunk_received is not None:
-                        on_chunk_received(f.tell())
-                if on_download_end is not None:
-                    on_download_end(f.tell())
+    ) -> dict[str, str]:
+        from apkd.download import FileDownloader
+        from apkd.net import Bandwidth
+
+        return FileDownloader(
+            url,
+            headers,
+            filename,
+            file_size,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+            retries=self.download_retries,
+            segments=self.download_segments,
+            digests=self.download_digests,
+            throttles=Bandwidth.get_buckets(self),
+            source=self,
+        ).download()
+
+    def bootstrap(self):
+        # one-time network setup (sessions, tokens), constructors stay cheap
+        # and sources that are never used never pay for it
+        pass
+
+    def ensure_bootstrapped(self):
+        with BaseSource.__lazy_lock:
+            try:
+                lock = self.__bootstrap_lock
+            except AttributeError:
+                lock = self.__bootstrap_lock = Lock()
+                self.__bootstrapped = False
+        # concurrent first calls wait for a single bootstrap; a failed one
+        # is repeated on the next call
+        with lock:
+            if not self.__bootstrapped:
+                self.bootstrap()
+                self.__bootstrapped = True
+
+    def get_limiter(self) -> "SourceLimiter":
+        from apkd.net import SourceLimiter
+
+        # created on the first request, so the limits can be changed before
+        with BaseSource.__lazy_lock:
+            try:
+                return self.__limiter
+            except AttributeError:
+                self.__limiter = SourceLimiter(
+                    self.rate_limit, self.rate_burst, self.max_in_flight
+                )
+                return self.__limiter
+
+    def get_bandwidth_bucket(self) -> "TokenBucket":
+        from apkd.net import Bandwidth, TokenBucket
+
+        with BaseSource.__lazy_lock:
+            try:
+                return self.__bandwidth
+            except AttributeError:
+                self.__bandwidth = TokenBucket(
+                    self.bandwidth_limit, Bandwidth.burst(self.bandwidth_limit)
+                )
+                return self.__bandwidth
 
     def get_download_link(self, pkg: str, version: "AppVersion") -> str:
+        if version.download_link is None and version.link_resolver is not None:
+            version.download_link = version.link_resolver(version)
         if version.download_link is None:
             raise TypeError(f'Download link missed for version "{version.code}"')
 
@@ -76,15 +202,75 @@ class BaseSource:
     def get_developer_id(self, package_name: str) -> str | None:
         return None
 
+    def get_app_details(self, pkg: str, versions_limit: int = -1) -> "AppDetails":
+        # versions and page-level data at once; sources that read both from
+        # the same page override it to fetch that page a single time
+        app = self.get_app_info(pkg, versions_limit)
+        return AppDetails(app, self.get_developer_id(pkg))
+
     def find_packages_from_developer(self, developer_id: str) -> set[str]:
         return set()
 
+    # async counterparts; sources with blocking I/O are offloaded to the
+    # event loop's default executor, native async sources override them
+    async def get_app_info_async(self, pkg: str, versions_limit: int = -1) -> "App":
+        import asyncio
+
+        return await asyncio.to_thread(self.get_app_info, pkg, versions_limit)
+
+    async def download_app_async(
+        self,
+        pkg: str,
+        version: "AppVersion",
+        output_file: Optional[str] = None,
+        on_download_start: Callable[["AppVersion", int], None] | None = None,
+        on_chunk_received: Callable[[int], None] | None = None,
+        on_download_end: Callable[[int], None] | None = None,
+    ):
+        import asyncio
+
+        await asyncio.to_thread(
+            self.download_app,
+            pkg,
+            version,
+            output_file,
+            on_download_start,
+            on_chunk_received,
+            on_download_end,
+        )
+
+    async def get_developer_id_async(self, package_name: str) -> str | None:
+        import asyncio
+
+        return await asyncio.to_thread(self.get_developer_id, package_name)
+
+    async def get_app_details_async(
+        self, pkg: str, versions_limit: int = -1
+    ) -> "AppDetails":
+        import asyncio
+
+        return await asyncio.to_thread(self.get_app_details, pkg, versions_limit)
+
+    async def find_packages_from_developer_async(self, developer_id: str) -> set[str]:
+        import asyncio
+
+        return await asyncio.to_thread(self.find_packages_from_developer, developer_id)
+
+    def split_batches(self, packages: list[str]) -> list[list[str]]:
+        return [
+            packages[i : i + self.batch_size]
+            for i in range(0, len(packages), self.batch_size)
+        ]
+
     def is_versions_limit(self, versions: list):
-        return self.__versions_limit != -1 and len(versions) >= self.__versions_limit
+        versions_limit = getattr(self.__call_state, "versions_limit", -1)
+        return versions_limit != -1 and len(versions) >= versions_limit
 
 
 class AppVersion:
     download_link: Optional[str] = None
+    # sources with a costly extra request for the link resolve it on download
+    link_resolver: Optional[Callable[["AppVersion"], str]] = None
     name: str
     code: int
     update_date: Optional[str] = None
@@ -99,11 +285,13 @@ class AppVersion:
         source: BaseSource,
         update_date: Optional[str] = None,
         download_link: Optional[str] = None,
+        link_resolver: Optional[Callable[["AppVersion"], str]] = None,
     ) -> None:
         if isinstance(update_date, str):
             self.update_date = update_date
         self.source = source
         self.download_link = download_link
+        self.link_resolver = link_resolver
         self.name = name
         self.code = code
         self.size = size
@@ -129,6 +317,23 @@ class App:
         return next((v for v in self.__versions if v.code == code))
 
 
+class AppDetails:
+    app: App
+    developer_id: Optional[str]
+    # anything else the store page tells about the app, e.g. its title
+    metadata: dict
+
+    def __init__(
+        self,
+        app: App,
+        developer_id: Optional[str] = None,
+        metadata: Optional[dict] = None,
+    ) -> None:
+        self.app = app
+        self.developer_id = developer_id
+        self.metadata = metadata or {}
+
+
 class AppNotFoundError(Exception):
     pass
 
@@ -137,67 +342,229 @@ class DeveloperNotFoundError(Exception):
     pass
 
 
-class Request:
-    @staticmethod
-    def get(url, params=None, use_cloudscraper: bool = False, **kwargs):
-        session = Request.session()
-        if use_cloudscraper:
-            session = cloudscraper.create_scraper(sess=session)
-            # Request.__set_middleware(session, RequestsMiddlewareCloudscraper())
-        return session.request("get", url, params, **kwargs)
-
-    @staticmethod
-    def post(url, data=None, json=None, **kwargs):
-        session = Request.session()
-        return session.request("post", url, data=data, json=json, **kwargs)
-
-    @staticmethod
-    def session():
-        session = requests.Session()
-        Request.__set_middleware(session, RequestsMiddleware())
-        return session
-
-    @staticmethod
-    def __set_middleware(
-        session: requests.Session, middleware: requests.adapters.HTTPAdapter
-    ):
-        session.mount("http://", middleware)
-        session.mount("https://", middleware)
+class TokenPool(Generic[T]):
+    # up to "size" tokens from "fetch", each valid for "ttl" seconds. While
+    # the pool is in use, tokens are renewed in the background before they
+    # expire, so acquire() waits for a fetch only when the pool is empty
+    RETRY_DELAY = 5
 
+    fetch: Callable[[], T]
+    ttl: float
+    size: int
+    refresh_margin: float
+    name: str
+    __tokens: list[tuple[T, float]]
+    __next: int
+    __used_at: float
+    __condition: Condition
+    __fetch_lock: Lock
+    __refresher: Optional[Thread]
+    __closed: bool
 
-class RequestsMiddleware(requests.adapters.HTTPAdapter):
-    def send(
-        self,
-        request: requests.PreparedRequest,
-        stream: bool = False,
-        timeout: None | float | tuple[float, float] | tuple[float, None] = None,
-        verify: bool | str = True,
-        cert: None | bytes | str | tuple[bytes | str, bytes | str] = None,
-        proxies=None,
-    ) -> requests.Response:
-        response = super().send(request, stream, timeout, verify, cert, proxies)
-        log_request(response.request, response)
-        return response
-
-
-class RequestsMiddlewareCloudscraper(cloudscraper.CipherSuiteAdapter):
-    def send(
+    def __init__(
         self,
-        request: requests.PreparedRequest,
-        stream: bool = False,
-        timeout: None | float | tuple[float, float] | tuple[float, None] = None,
-        verify: bool | str = True,
-        cert: None | bytes | str | tuple[bytes | str, bytes | str] = None,
-        proxies=None,
-    ) -> requests.Response:
-        response = super().send(request, stream, timeout, verify, cert, proxies)
-        log_request(response.request, response)
-        return response
-
-
-def log_request(request: requests.PreparedRequest, response: requests.Response):
-    get_logger().debug(f"Request: {request.url}, response code: {response.status_code}")
+        fetch: Callable[[], T],
+        ttl: float,
+        size: int = 1,
+        refresh_margin: Optional[float] = None,
+        name: str = "token",
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.size = max(size, 1)
+        self.refresh_margin = ttl / 4 if refresh_margin is None else refresh_margin
+        self.name = name
+        self.__tokens = []
+        self.__next = 0
+        self.__used_at = 0
+        self.__condition = Condition()
+        self.__fetch_lock = Lock()
+        self.__refresher = None
+        self.__closed = False
+
+    def acquire(self) -> T:
+        with self.__condition:
+            if self.__is_idle():
+                # wake the refresher up, it stops renewing an unused pool
+                self.__condition.notify_all()
+            self.__used_at = time.monotonic()
+            self.__start_refresher()
+            tokens = self.__valid_tokens()
+            if len(tokens) > 0:
+                self.__next = (self.__next + 1) % len(tokens)
+                return tokens[self.__next][0]
+
+        # one fetch at a time, the other callers get its token
+        with self.__fetch_lock:
+            with self.__condition:
+                tokens = self.__valid_tokens()
+                if len(tokens) > 0:
+                    return tokens[0][0]
+            token = self.fetch()
+            self.__add(token)
+            return token
+
+    def invalidate(self, token: T):
+        # e.g. a token rejected by the server
+        with self.__condition:
+            self.__tokens = [t for t in self.__tokens if t[0] != token]
+            self.__condition.notify_all()
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def __valid_tokens(self) -> list[tuple[T, float]]:
+        now = time.monotonic()
+        self.__tokens = [t for t in self.__tokens if t[1] > now]
+        return self.__tokens
+
+    def __is_idle(self) -> bool:
+        return time.monotonic() - self.__used_at > self.ttl
+
+    def __add(self, token: T):
+        with self.__condition:
+            self.__tokens.append((token, time.monotonic() + self.ttl))
+            # the new token replaces the one closest to expiry
+            self.__tokens.sort(key=lambda t: t[1], reverse=True)
+            del self.__tokens[self.size :]
+            self.__condition.notify_all()
+
+    def __start_refresher(self):
+        if self.__refresher is None or not self.__refresher.is_alive():
+            self.__refresher = Thread(target=self.__refresh, daemon=True)
+            self.__refresher.start()
+
+    def __fresh_tokens(self) -> list[tuple[T, float]]:
+        now = time.monotonic()
+        return [t for t in self.__valid_tokens() if t[1] - now > self.refresh_margin]
+
+    def __needs_refresh(self) -> bool:
+        return not self.__is_idle() and len(self.__fresh_tokens()) < self.size
+
+    def __refresh(self):
+        while True:
+            with self.__condition:
+                if self.__closed:
+                    return
+                if not self.__needs_refresh():
+                    now = time.monotonic()
+                    wake_at = min(
+                        (t[1] - self.refresh_margin for t in self.__fresh_tokens()),
+                        default=now,
+                    )
+                    if self.__is_idle():
+                        wake_at = now + self.ttl
+                    self.__condition.wait(max(wake_at - now, 0.1))
+                    continue
+
+            # shares the lock with acquire(), a token fetched by a caller in
+            # the meantime is not fetched again
+            error = None
+            with self.__fetch_lock:
+                with self.__condition:
+                    if not self.__needs_refresh():
+                        continue
+                try:
+                    self.__add(self.fetch())
+                except Exception as e:
+                    error = e
+            if error is not None:
+                get_logger().warning(f"Unable to renew {self.name}: {error}")
+                with self.__condition:
+                    self.__condition.wait(self.RETRY_DELAY)
 
 
 def get_logger():
     return logging.getLogger("apkd")
+
+
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get("APKD_CACHE_DIR")
+    if not cache_dir:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        cache_dir = os.path.join(cache_home, "apkd")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def save_json(path: str, data, compress: bool = False, **kwargs):
+    # written next to the target and renamed over it, readers (and a crash
+    # halfway) never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    if compress:
+        import gzip
+
+        f = gzip.open(tmp_path, "wt")
+    else:
+        f = open(tmp_path, "w")
+    try:
+        with f:
+            json.dump(data, f, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DeferredJsonWriter:
+    # saves the document from "snapshot" at most every "interval" seconds
+    # instead of on every change, a pending change is saved by a timer within
+    # "interval" and at exit
+    path: str
+    snapshot: Callable[[], object]
+    interval: float
+    dump_kwargs: dict
+    __dirty: bool
+    __saved_at: float
+    __timer: Optional[Timer]
+    __lock: Lock
+
+    def __init__(
+        self,
+        path: str,
+        snapshot: Callable[[], object],
+        interval: float = 5,
+        **dump_kwargs,
+    ):
+        self.path = path
+        self.snapshot = snapshot
+        self.interval = interval
+        self.dump_kwargs = dump_kwargs
+        self.__dirty = False
+        self.__saved_at = time.monotonic()
+        self.__timer = None
+        self.__lock = Lock()
+        atexit.register(self.flush)
+
+    def changed(self):
+        # callers must not hold the lock "snapshot" takes
+        with self.__lock:
+            self.__dirty = True
+            delay = self.__saved_at + self.interval - time.monotonic()
+            if delay > 0:
+                if self.__timer is None:
+                    self.__timer = Timer(delay, self.flush)
+                    self.__timer.daemon = True
+                    self.__timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            self.__saved_at = time.monotonic()
+            try:
+                save_json(self.path, self.snapshot(), **self.dump_kwargs)
+            except OSError as e:
+                self.__dirty = True
+                get_logger().warning(f"Unable to save {self.path}: {e}")
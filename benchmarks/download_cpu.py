@@ -0,0 +1,96 @@
+# CPU time spent per GB by the download loop, measured against a local server:
+#   python benchmarks/download_cpu.py [--size-mb 1024] [--digest sha256]
+import argparse
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from apkd.download import FileDownloader  # noqa: E402
+from apkd.utils import Request  # noqa: E402
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+def serve(size: int) -> http.server.ThreadingHTTPServer:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            for _ in range(size // len(BLOCK)):
+                self.wfile.write(BLOCK)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_download(url: str, filename: str, on_chunk_received):
+    # the loop used before: 8 KB chunks, tell() and a callback for each one
+    with Request.get(url, stream=True) as r, open(filename, "wb") as f:
+        for chunk in r.iter_content(chunk_size=8192):
+            f.write(chunk)
+            on_chunk_received(f.tell())
+
+
+def measure(name: str, size: int, download) -> None:
+    calls = 0
+
+    def on_chunk_received(_: int):
+        nonlocal calls
+        calls += 1
+
+    cpu, wall = time.thread_time(), time.perf_counter()
+    download(on_chunk_received)
+    cpu, wall = time.thread_time() - cpu, time.perf_counter() - wall
+    gb = size / 1024**3
+    print(
+        f"{name:8} {cpu / gb:6.2f} s CPU/GB  {size / wall / 1024**2:8.1f} MB/s  "
+        f"{calls} progress calls"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--digest", nargs="*", default=[])
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    server = serve(size)
+    url = f"http://127.0.0.1:{server.server_port}/file.apk"
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "file.apk")
+        measure(
+            "legacy",
+            size,
+            lambda on_chunk: legacy_download(url, filename, on_chunk),
+        )
+        os.remove(filename)
+        measure(
+            "apkd",
+            size,
+            lambda on_chunk: FileDownloader(
+                url,
+                {},
+                filename,
+                size,
+                on_chunk_received=on_chunk,
+                digests=tuple(args.digest),
+            ).download(),
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
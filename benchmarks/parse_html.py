@@ -0,0 +1,149 @@
+# Parse + extract time of synthetic source pages, per parser backend:
+#   python benchmarks/parse_html.py [--runs 20] [--versions 100]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from apkd.parsing import HtmlParser  # noqa: E402
+
+# navigation, scripts and recommendations make up most of the real pages
+FILLER = (
+    '<div class="nav"><ul>'
+    + "".join(
+        f'<li><a href="/c/{i}" class="nav-link">Category {i}</a></li>'
+        for i in range(40)
+    )
+    + "</ul></div>"
+    + "".join(
+        f'<div class="card"><img src="/i/{i}.png" alt="app {i}">'
+        f'<p class="title">Recommended app {i}</p>'
+        f'<span class="stars">4.{i % 10}</span></div>'
+        for i in range(150)
+    )
+    + "<script>" + "var x = 1;" * 2000 + "</script>"
+)
+
+
+def apkpure_versions(count: int) -> str:
+    versions = "".join(
+        f'<li><a class="ver_download_link" data-dt-apkid="b/APK/com.example" '
+        f'data-dt-version="1.{i}" data-dt-versioncode="{1000 - i}" '
+        f'data-dt-filesize="{i * 1024}"><span class="ver-item-n">1.{i}</span>'
+        f'<span class="update-on">Jan {i % 28 + 1}, 2024</span></a></li>'
+        for i in range(count)
+    )
+    return (
+        f"<html><head><title>x</title></head><body>{FILLER}"
+        f'<p class="ver_dev"><a href="/developer/Example">Example</a></p>'
+        f'<ul class="ver-wrap">{versions}</ul>{FILLER}</body></html>'
+    )
+
+
+def apkcombo_downloader(count: int) -> str:
+    variants = "".join(
+        f'<a class="variant" href="https://apkcombo.com/d?u={i}">'
+        f'<span class="vername">Example 1.{i}</span>'
+        f'<span class="vercode">({1000 - i})</span>'
+        f'<span class="type-apk">APK</span><span class="spec">{i}.5 MB</span></a>'
+        for i in range(count)
+    )
+    return (
+        f'<div>{FILLER}<div class="author"><a class="is-link">Example</a></div>'
+        f"{variants}{FILLER}</div>"
+    )
+
+
+def fdroid_package(count: int) -> str:
+    versions = "".join(
+        f'<li class="package-version"><div class="package-version-header">'
+        f'<a name="1.{i}"></a><a name="{1000 - i}"></a> '
+        f"Version 1.{i} Added on Jan {i % 28 + 1}, 2024</div>"
+        f'<p class="package-version-download">'
+        f'<a href="https://f-droid.org/repo/x_{i}.apk">download</a> '
+        f"<span>{i}.5 MiB</span></p></li>"
+        for i in range(count)
+    )
+    return f"<html><body>{FILLER}<ul>{versions}</ul>{FILLER}</body></html>"
+
+
+def extract_apkpure(soup: BeautifulSoup) -> list:
+    links = soup.find_all("a", class_="ver_download_link")
+    return [a.get("data-dt-versioncode") for a in links]
+
+
+def extract_apkcombo(soup: BeautifulSoup) -> list:
+    variants = soup.find_all("a", class_="variant")
+    return [a.find("span", class_="vercode").get_text() for a in variants]
+
+
+def extract_fdroid(soup: BeautifulSoup) -> list:
+    return [
+        li.find("div", class_="package-version-header").findChildren("a")[1].get("name")
+        for li in soup.find_all("li", class_="package-version")
+    ]
+
+
+PAGES = {
+    "apkpure versions": (apkpure_versions, ("a", "ver_download_link"), extract_apkpure),
+    "apkcombo downloader": (apkcombo_downloader, ("a", "variant"), extract_apkcombo),
+    "f-droid package": (fdroid_package, ("li", "package-version"), extract_fdroid),
+}
+
+
+def measure(runs: int, parse, extract) -> tuple[float, list]:
+    timings = []
+    result: list = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = extract(parse())
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--versions", type=int, default=100)
+    args = parser.parse_args()
+
+    backends = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+
+        backends.insert(0, "lxml")
+    except ImportError:
+        print("lxml is not installed, only html.parser is measured")
+
+    for page_name, (make_page, only, extract) in PAGES.items():
+        html = make_page(args.versions)
+        print(f"{page_name} ({len(html) // 1024} KiB)")
+        baseline, expected = measure(
+            args.runs, lambda: BeautifulSoup(html, features="html.parser"), extract
+        )
+        print(f"  {'html.parser, full page':28} {baseline * 1000:7.1f} ms")
+        for backend in backends:
+            HtmlParser.set_backend(backend)
+            for strained in (False, True):
+                if backend == "html.parser" and not strained:
+                    # the baseline
+                    continue
+                targets = (only,) if strained else ()
+                elapsed, result = measure(
+                    args.runs, lambda: HtmlParser.parse(html, *targets), extract
+                )
+                assert result == expected, f"{backend} extracted different data"
+                name = f"{backend}, {'needed nodes' if strained else 'full page'}"
+                print(
+                    f"  {name:28} {elapsed * 1000:7.1f} ms"
+                    f"  x{baseline / elapsed:.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Wall time of short CLI invocations, each in a fresh interpreter:
+#   python benchmarks/startup.py [--runs 20]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CASES = {
+    "--version": ["--version"],
+    "--help": ["--help"],
+    # parsed and validated, fails before any network request
+    "parse args": ["-p", "com.example", "-d", "--output", "x.apk", "-vc", "x"],
+    "import only": None,
+}
+
+
+def run(argv) -> float:
+    if argv is None:
+        code = "import apkd.main"
+    else:
+        code = (
+            f"import sys; sys.argv = ['apkd'] + {argv!r}\n"
+            "from apkd.main import cli; cli()"
+        )
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_python_only() for _ in range(args.runs))
+    print(f"{'python -c pass':14} {baseline * 1000:7.1f} ms")
+    for name, argv in CASES.items():
+        timings = [run(argv) for _ in range(args.runs)]
+        print(f"{name:14} {statistics.median(timings) * 1000:7.1f} ms")
+
+
+def run_python_only() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    main()
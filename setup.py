@@ -9,6 +9,7 @@ setup(
     version='1.1.2',
     author='kiber.io',
     license='MIT',
+    python_requires='>=3.10',
     url='https://github.com/kiber-io/apkd',
     install_requires=[
         'prettytable==3.11.0',
@@ -17,6 +18,9 @@ setup(
         'beautifulsoup4==4.12.3',
         'user_agent==0.1.10'
     ],
+    extras_require={
+        'lxml': ['lxml>=4.9']
+    },
     include_package_data=True,
     keywords=['apk downloader', 'apk download', 'android downloader', 'app downloader', 'app download'],
     description='APK downloader from few sources',